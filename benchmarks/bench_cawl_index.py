@@ -0,0 +1,73 @@
+"""Compare the single-pass CAWL index with the former per-sense search.
+
+The sample LIFT files in test/ are scaled up by repeating their entries.
+
+usage: python3 benchmarks/bench_cawl_index.py [-n SCALE] [-r REPEAT]
+"""
+import argparse
+import sys
+import timeit
+
+from copy import deepcopy
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+from update_flex import util  # noqa: E402
+
+SAMPLES = [
+    (Path(__file__).parents[1] / 'test' / 'Banda-Linda-sample.lift', 'SIL Cawl'),
+    (Path(__file__).parents[1] / 'test' / 'Vale FLEx LIFT export.lift', 'CAWL'),
+]
+
+
+def get_cawl_from_sense_per_sense(sense, cawl_type):
+    cawl = None
+    for field in sense.findall('.//field[@type]'):
+        if field.get('type') == cawl_type:
+            cawl = field.find('form').find('text').text.strip()
+        if cawl:
+            break
+    return cawl
+
+def get_cawl_dict_per_sense(xml_tree, cawl_type):
+    # Previous implementation: one subtree search per sense.
+    cawls = dict()
+    for sense in xml_tree.findall('.//sense'):
+        cawl = get_cawl_from_sense_per_sense(sense, cawl_type)
+        if cawls.get(cawl) is None:
+            cawls[cawl] = [sense]
+        else:
+            cawls[cawl].append(sense)
+    return cawls
+
+def scale_tree(xml_tree, scale):
+    root = xml_tree.getroot()
+    entries = root.findall('entry')
+    for _ in range(scale - 1):
+        for entry in entries:
+            root.append(deepcopy(entry))
+    return xml_tree
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--scale', type=int, default=20, help="times to repeat each sample's entries [20]")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="timing runs per function [3]")
+    args = parser.parse_args()
+
+    for sample, cawl_type in SAMPLES:
+        xml_tree = scale_tree(util.get_xml_tree(sample), args.scale)
+        n_senses = len(xml_tree.findall('.//sense'))
+        old = get_cawl_dict_per_sense(xml_tree, cawl_type)
+        new = util.get_cawl_dict(xml_tree, cawl_type)
+        assert {k: len(v) for k, v in old.items() if k} == {k: len(v) for k, v in new.items() if k}
+
+        t_old = min(timeit.repeat(lambda: get_cawl_dict_per_sense(xml_tree, cawl_type), number=1, repeat=args.repeat))
+        t_new = min(timeit.repeat(lambda: util.get_cawl_dict(xml_tree, cawl_type), number=1, repeat=args.repeat))
+        print(
+            f"{sample.name} x{args.scale} ({n_senses} senses): "
+            f"per-sense {t_old:.3f}s, single-pass {t_new:.3f}s, speedup {t_old / t_new:.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare indexed fallback matching with comparing each sense to every source key.
+
+Target senses are matched by their text as if they had no CAWL. The pairwise
+approach computes the trigram similarity of each of a sense's keys with every
+source key, so it's only run on a sample of senses.
+
+usage: python3 benchmarks/bench_fallback.py [-n SIZES] [-s SAMPLE] [-d DATA_DIR]
+"""
+import argparse
+import itertools
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+from update_flex import fallback  # noqa: E402
+from update_flex import index  # noqa: E402
+from update_flex import util  # noqa: E402
+
+from run import get_data_files  # noqa: E402
+
+
+def match_pairwise(fallback_index, sense):
+    # Best similarity over all source keys, for each of the sense's keys.
+    best = None
+    for lang, text in fallback.get_sense_keys(sense):
+        trigrams = fallback.get_trigrams(text)
+        for (key_lang, _), key_trigrams in zip(fallback_index.keys, fallback_index.key_trigrams):
+            if key_lang != lang:
+                continue
+            similarity = 2 * len(trigrams & key_trigrams) / (len(trigrams) + len(key_trigrams))
+            if best is None or similarity > best:
+                best = similarity
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--sizes', default='10000,100000', help="comma-separated numbers of senses [10000,100000]")
+    parser.add_argument('-s', '--sample', type=int, default=100, help="number of senses matched pairwise [100]")
+    parser.add_argument(
+        '-d', '--data-dir', default=str(Path(__file__).parent / 'data'),
+        help="where generated LIFT files are kept between runs [benchmarks/data]",
+    )
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        source_file, target_file = get_data_files(Path(args.data_dir), size)
+        source_index = index.read_source_index(source_file, 'CAWL')
+        t = time.perf_counter()
+        fallback_index = fallback.FallbackIndex(source_index)
+        t_build = time.perf_counter() - t
+
+        senses = [s for entry in util.iter_xml_entries(target_file) for s in entry.iter('sense')]
+        t = time.perf_counter()
+        matched = sum(1 for sense in senses if fallback_index.match_sense(sense) is not None)
+        t_indexed = (time.perf_counter() - t) / len(senses)
+        t = time.perf_counter()
+        for sense in itertools.islice(senses, args.sample):
+            match_pairwise(fallback_index, sense)
+        t_pairwise = (time.perf_counter() - t) / args.sample
+        print(
+            f"{size:>8} senses  index: {fallback_index}, built in {t_build:.2f}s  "
+            f"indexed: {t_indexed * 1000:.3f} ms/sense ({matched} matched)  "
+            f"pairwise: {t_pairwise * 1000:.1f} ms/sense  speedup {t_pairwise / t_indexed:.0f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
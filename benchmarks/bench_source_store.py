@@ -0,0 +1,76 @@
+"""Compare the memory held by the source index with that of the source tree.
+
+Before, the whole source lxml tree was kept alive for the run and the index
+held its sense elements. Now compact records are extracted while the file is
+read one entry at a time. Each approach runs in its own process.
+
+usage: python3 benchmarks/bench_source_store.py [-n SIZES] [-d DATA_DIR]
+"""
+import argparse
+import gc
+import pickle
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+from update_flex import index  # noqa: E402
+from update_flex import util  # noqa: E402
+from update_flex.profiling import PeakMemory  # noqa: E402
+from update_flex.profiling import get_rss  # noqa: E402
+
+from run import get_data_files  # noqa: E402
+
+
+def build_tree_index(source_file):
+    # Former approach: the tree and a dict of its sense elements.
+    xml_tree = util.get_xml_tree(source_file)
+    return xml_tree, util.get_cawl_dict(xml_tree, 'CAWL')
+
+def build_record_index(source_file):
+    return index.read_source_index(source_file, 'CAWL')
+
+def measure(approach, source_file):
+    build = build_tree_index if approach == 'tree' else build_record_index
+    gc.collect()
+    with PeakMemory() as mem:
+        t = time.perf_counter()
+        value = build(source_file)
+        elapsed = time.perf_counter() - t
+    gc.collect()
+    result = {
+        'seconds': elapsed,
+        'held_mb': (get_rss() - mem.start) / 2**20,
+        'peak_mb': (mem.peak - mem.start) / 2**20,
+    }
+    if approach == 'records':
+        result['pickle_mb'] = len(pickle.dumps(value)) / 2**20
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--sizes', default='10000,100000', help="comma-separated numbers of senses [10000,100000]")
+    parser.add_argument(
+        '-d', '--data-dir', default=str(Path(__file__).parent / 'data'),
+        help="where generated LIFT files are kept between runs [benchmarks/data]",
+    )
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        source_file, _ = get_data_files(Path(args.data_dir), size)
+        results = dict()
+        for approach in ('tree', 'records'):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results[approach] = executor.submit(measure, approach, source_file).result()
+        old, new = results['tree'], results['records']
+        print(
+            f"{size:>8} senses  tree: {old['held_mb']:.1f} MB held, {old['seconds']:.2f}s  "
+            f"records: {new['held_mb']:.1f} MB held (peak +{new['peak_mb']:.1f} MB), {new['seconds']:.2f}s, "
+            f"{new['pickle_mb']:.1f} MB pickled  saved {old['held_mb'] - new['held_mb']:.1f} MB"
+        )
+
+
+if __name__ == '__main__':
+    main()
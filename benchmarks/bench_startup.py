@@ -0,0 +1,53 @@
+"""Time the start of the update-flex command line.
+
+Each run is a new interpreter, as in a batch script: `update-flex -V` and a
+basic update of the sample Banda-Linda file from the sample Vale file.
+
+usage: python3 benchmarks/bench_startup.py [-r REPEAT]
+"""
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+SOURCE = ROOT / 'test' / 'Vale FLEx LIFT export.lift'
+TARGET = ROOT / 'test' / 'Banda-Linda-sample.lift'
+COMMAND = [sys.executable, '-c', 'import update_flex.app; update_flex.app.main()']
+
+
+def time_command(args, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        subprocess.run(COMMAND + args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=10, help="runs per command [10]")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        target = Path(d) / TARGET.name
+        shutil.copy(TARGET, target)
+        runs = {
+            'update-flex -V': ['-V'],
+            'update-flex (update)': [str(SOURCE), str(target), '-g', 'en,fr', '-s', '-I', 'SIL Cawl'],
+        }
+        for name, command_args in runs.items():
+            times = time_command(command_args, args.repeat)
+            print(
+                f"{name:<22} min {min(times) * 1000:>7.1f} ms  "
+                f"median {statistics.median(times) * 1000:>7.1f} ms"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Compare memoized term normalization with the former per-call splitting.
+
+Gloss and semantic domain strings are taken from a generated target file,
+where semantic domains repeat across many senses and glosses mostly don't.
+
+usage: python3 benchmarks/bench_terms.py [-n SENSES] [-d DATA_DIR]
+"""
+import argparse
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+from update_flex import util  # noqa: E402
+
+from run import get_data_files  # noqa: E402
+
+
+def join_terms_per_call(texts):
+    # Previous implementation, as used by dedupe_glosses.
+    texts = util.normalize_list(texts)
+    terms = []
+    for text in texts:
+        terms.extend(util.normalize_list(text.split(';')))
+    return ' ; '.join(util.normalize_list(terms))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--senses', type=int, default=100000, help="number of senses [100000]")
+    parser.add_argument(
+        '-d', '--data-dir', default=str(Path(__file__).parent / 'data'),
+        help="where generated LIFT files are kept between runs [benchmarks/data]",
+    )
+    args = parser.parse_args()
+
+    _, target_file = get_data_files(Path(args.data_dir), args.senses)
+    xml_tree = util.get_xml_tree(target_file)
+    samples = {
+        'semantic domains': [t.get('value') for t in xml_tree.iter('trait') if t.get('name') == 'semantic-domain-ddp4'],
+        'glosses': [g.findtext('text') for g in xml_tree.iter('gloss')],
+    }
+    for name, texts in samples.items():
+        util.split_text.cache_clear()
+        util.normalize_text.cache_clear()
+        t = time.perf_counter()
+        old = [join_terms_per_call([text]) for text in texts]
+        t_old = time.perf_counter() - t
+        t = time.perf_counter()
+        new = [util.join_terms([text]) for text in texts]
+        t_new = time.perf_counter() - t
+        assert old == new
+        print(
+            f"{name} ({len(texts)} strings, {len(set(texts))} distinct): "
+            f"per-call {t_old:.3f}s, memoized {t_new:.3f}s, speedup {t_old / t_new:.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
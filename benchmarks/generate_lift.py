@@ -0,0 +1,110 @@
+"""Generate synthetic LIFT files shaped like FLEx exports for benchmarking.
+
+Entries have a lexical-unit, 1-3 senses with multi-language glosses
+(including repeated terms and duplicate gloss elements), a
+semantic-domain-ddp4 trait and a CAWL field.
+
+usage: python3 benchmarks/generate_lift.py [-t CAWL_TYPE] [-l LANGS] [-s SEED] SENSES OUTFILE
+"""
+import argparse
+import random
+import uuid
+
+from lxml import etree
+
+LX_LANG = 'liy'
+SEMANTIC_DOMAINS = [
+    '1.1.1 Soleil',
+    '1.2.1.1 Mountain',
+    '2.1.1 Head',
+    '5.2.3.1.5 Nourriture provenant de racines',
+    '6.2.1.1 Growing crops',
+    '9.1.1 Be',
+]
+SYLLABLES = ['a', 'ba', 'da', 'ɛ', 'gi', 'kɔ', 'lo', 'ma', 'nu', 'ŋa', 'pi', 'sə', 'to', 'wû', 'ya', 'zo']
+
+
+def random_word(rng, syllables=(1, 3)):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables)))
+
+def gloss_text(rng):
+    terms = [random_word(rng) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.2:
+        # Repeated term within a single gloss.
+        terms.append(terms[0])
+    return ' ; '.join(terms)
+
+def add_form(parent, tag, lang, text):
+    elem = etree.SubElement(parent, tag, lang=lang)
+    etree.SubElement(elem, 'text').text = text
+    return elem
+
+def make_entry(rng, cawl_type, langs, cawls):
+    guid = str(uuid.UUID(int=rng.getrandbits(128)))
+    lx = random_word(rng, (2, 4))
+    entry = etree.Element(
+        'entry',
+        dateCreated='2018-02-28T20:22:16Z',
+        dateModified='2018-03-21T19:23:54Z',
+        id=f"{lx}_{guid}",
+        guid=guid,
+    )
+    lexical_unit = etree.SubElement(entry, 'lexical-unit')
+    add_form(lexical_unit, 'form', LX_LANG, lx)
+    etree.SubElement(entry, 'trait', name='morph-type', value='stem')
+
+    for cawl in cawls:
+        sense = etree.SubElement(entry, 'sense', id=str(uuid.UUID(int=rng.getrandbits(128))))
+        etree.SubElement(sense, 'grammatical-info', value='Nom')
+        for lang in langs:
+            if rng.random() < 0.1:
+                continue # some languages have no gloss
+            add_form(sense, 'gloss', lang, gloss_text(rng))
+            if rng.random() < 0.05:
+                # Duplicate gloss element for the same language.
+                add_form(sense, 'gloss', lang, gloss_text(rng))
+        definition = etree.SubElement(sense, 'definition')
+        add_form(definition, 'form', langs[0], gloss_text(rng))
+        sd = rng.choice(SEMANTIC_DOMAINS)
+        if rng.random() < 0.1:
+            sd = f"{sd} ; {sd}"
+        etree.SubElement(sense, 'trait', name='semantic-domain-ddp4', value=sd)
+        if cawl is not None:
+            field = etree.SubElement(sense, 'field', type=cawl_type)
+            add_form(field, 'form', 'en', str(cawl))
+    return entry
+
+def generate_lift(outfile, n_senses, cawl_type='CAWL', langs=('en', 'fr', 'sg'), seed=0, n_cawls=None):
+    """Write a LIFT file with n_senses senses one entry at a time."""
+    rng = random.Random(seed)
+    if n_cawls is None:
+        n_cawls = max(1, n_senses * 9 // 10)
+    with etree.xmlfile(str(outfile), encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('lift', producer='update-flex benchmarks', version='0.13'):
+            xf.write('\n')
+            header = etree.Element('header')
+            ranges = etree.SubElement(header, 'ranges')
+            etree.SubElement(ranges, 'range', id='semantic-domain-ddp4', href='file://FLEX.lift-ranges')
+            xf.write(header, pretty_print=True)
+            written = 0
+            while written < n_senses:
+                n = min(rng.choice([1, 1, 1, 2, 3]), n_senses - written)
+                # About 5% of senses have no CAWL field.
+                cawls = [rng.randint(1, n_cawls) if rng.random() > 0.05 else None for _ in range(n)]
+                xf.write(make_entry(rng, cawl_type, langs, cawls), pretty_print=True)
+                written += n
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('senses', type=int, help="number of senses to generate")
+    parser.add_argument('outfile', help="the LIFT file to write")
+    parser.add_argument('-t', '--cawl-type', default='CAWL', help="the CAWL field type [CAWL]")
+    parser.add_argument('-l', '--langs', default='en,fr,sg', help="comma-separated gloss languages [en,fr,sg]")
+    parser.add_argument('-s', '--seed', type=int, default=0, help="random seed [0]")
+    args = parser.parse_args()
+    generate_lift(args.outfile, args.senses, args.cawl_type, args.langs.split(','), args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Time the main update phases on synthetic LIFT files and record peak memory.
+
+Each size runs in its own process so that peak RSS isn't carried over from
+larger runs. Results can be saved as JSON to compare app versions.
+
+usage: python3 benchmarks/run.py [-n SIZES] [-d DATA_DIR] [-o OUTPUT]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+from update_flex import engine  # noqa: E402
+from update_flex import index  # noqa: E402
+from update_flex import util  # noqa: E402
+from update_flex.profiling import PeakMemory  # noqa: E402
+
+from generate_lift import generate_lift  # noqa: E402
+
+PHASES = ['get_cawl_dict', 'read_source_index', 'get_xml_tree', 'update_file', 'save_xml_to_file']
+UPDATES = {'glosses': ['en', 'fr', 'sg'], 'semantic-domain': True, 'allow-overwrite': True}
+
+
+def measure(results, phase, func, *args):
+    with PeakMemory() as mem:
+        t = time.perf_counter()
+        value = func(*args)
+        elapsed = time.perf_counter() - t
+    results[phase] = {
+        'seconds': round(elapsed, 4),
+        'peak_rss_mb': round(mem.peak / 2**20, 1),
+        'delta_rss_mb': round((mem.peak - mem.start) / 2**20, 1),
+    }
+    return value
+
+def run_size(source_file, target_file):
+    results = {}
+    source_xml = util.get_xml_tree(source_file)
+    measure(results, 'get_cawl_dict', util.get_cawl_dict, source_xml, 'CAWL')
+    del source_xml
+    source_index = measure(results, 'read_source_index', index.read_source_index, source_file, 'CAWL')
+    target_xml = measure(results, 'get_xml_tree', util.get_xml_tree, target_file)
+    # Leave out the time spent printing per-CAWL messages.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        measure(
+            results, 'update_file', engine.update_tree,
+            target_xml, source_index, 'CAWL', UPDATES, engine.Result(target_file),
+        )
+    with tempfile.TemporaryDirectory() as d:
+        measure(results, 'save_xml_to_file', util.save_xml_tree, target_xml, Path(d) / 'out.lift')
+    return results
+
+def get_data_files(data_dir, size):
+    data_dir.mkdir(parents=True, exist_ok=True)
+    source_file = data_dir / f"source-{size}.lift"
+    target_file = data_dir / f"target-{size}.lift"
+    if not source_file.is_file():
+        generate_lift(source_file, size, seed=1)
+    if not target_file.is_file():
+        generate_lift(target_file, size, seed=2)
+    return source_file, target_file
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '-n', '--sizes', default='1000,10000,100000',
+        help="comma-separated numbers of senses, up to 1000000 [1000,10000,100000]",
+    )
+    parser.add_argument(
+        '-d', '--data-dir', default=str(Path(__file__).parent / 'data'),
+        help="where generated LIFT files are kept between runs [benchmarks/data]",
+    )
+    parser.add_argument('-o', '--output', help="save results to this JSON file")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    report = {
+        'version': util.get_version_string(),
+        'python': platform.python_version(),
+        'lxml': '.'.join(str(n) for n in etree.LXML_VERSION),
+        'results': {},
+    }
+    for size in sizes:
+        source_file, target_file = get_data_files(Path(args.data_dir), size)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results = executor.submit(run_size, source_file, target_file).result()
+        report['results'][size] = results
+        for phase in PHASES:
+            r = results[phase]
+            print(
+                f"{size:>8} senses  {phase:<17} {r['seconds']:>8.3f}s  "
+                f"peak {r['peak_rss_mb']:>8.1f} MB  (+{r['delta_rss_mb']:.1f} MB)"
+            )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Results saved as \"{args.output}\"")
+
+
+if __name__ == '__main__':
+    main()
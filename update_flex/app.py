@@ -1,33 +1,33 @@
-from lxml import etree
+import sys
+
+from contextlib import nullcontext
 from pathlib import Path
 from sys import exit
-from tkinter import Tk
 
-from . import gui
+from . import engine
+from . import index
+from . import profiling
+from . import progress
 from . import util
 
 
-class App(Tk):
+class App:
     def __init__(self, cli_args, **kwargs):
-        super().__init__(**kwargs)
         self.classname = kwargs.get('className')
-        self.version = util.get_version_string()
-        self.title(f"Update fields in FLEx LIFT file - v{self.version}")
-
         self.args = cli_args
 
         # Handle 'version' option.
         if self.args.version:
-            print(self.version)
+            print(util.get_version_string())
             exit()
 
         # Define default values.
         self.source_cawl_type_default = 'CAWL'
         self.source_file_default = None
-        self.source_xml_default = None
+        self.extra_source_files_default = []
+        self.source_index_default = None
         self.target_cawl_type_default = 'CAWL'
         self.target_files_default = []
-        self.target_xml_default = None
         self.updates_default = dict()
 
         # Set variables to defaults.
@@ -38,25 +38,27 @@ class App(Tk):
 
         # Run GUI if no target_db given.
         if not self.args.source_db and self.args.target_db == []:
-            gui.Gui(self, class_=self.classname)
-            self.mainloop()
+            self.run_gui()
 
         # Parse script arguments.
         if self.args.source_db and self.args.target_db == []:
             # Print source file XML and exit.
             self.target_file = Path(self.args.source_db)
-            util.print_xml_tree(util.get_xml_tree(self.target_file))
+            util.format_xml_file(self.target_file, sys.stdout.buffer)
             exit()
         elif self.args.source_db: # update target file(s)
             # Gather source file data.
             self.source_file = Path(self.args.source_db).resolve()
-            self.source_xml = util.get_xml_tree(self.source_file)
-            if self.updates.get('glosses') is None and not self.updates.get('semantic-domain'):
-                lx_lang = util.get_lx_lang(self.source_xml.findall('entry')[0])
-                if not lx_lang:
-                    print(f"ERROR: Source language not found in {self.args.source_db}")
-                    exit(1)
-                self.updates['glosses'] = [lx_lang]
+            self.extra_source_files = [Path(f).resolve() for f in self.args.extra_source or []]
+            # Index source file(s) once for all target files.
+            try:
+                updater = self.get_updater(self.get_progress_bar(self.source_file.name))
+            except ValueError as e:
+                print(f"ERROR: {e}")
+                exit(1)
+            self.updates = updater.updates
+            if self.debug and updater.fallback_index is not None:
+                print(f"Debug: Fallback index: {updater.fallback_index}")
 
             # Gather target files.
             self.target_files = [Path(f).resolve() for f in self.args.target_db]
@@ -66,33 +68,150 @@ class App(Tk):
                 self.print_debug_variables()
 
             # Process files.
-            for target_file in self.target_files:
-                if self.debug:
-                    print(f"Debug: {target_file = }")
-                self.target_xml = util.get_xml_tree(target_file)
-                result = self.update_file(target_file)
-                if self.debug:
-                    print(f"Debug: Update {result = }")
+            if self.incremental:
+                from . import manifest
+
+                # Only update CAWLs that have changed since the last run on
+                #   each target; targets with the same changes are updated
+                #   together.
+                source_index = updater.source_index
+                hashes = manifest.get_hashes(source_index, self.updates)
+                old_manifest = manifest.load_manifest(self.args.incremental)
+                target_groups = dict()
+                for target_file in self.target_files:
+                    changed_cawls = frozenset(
+                        manifest.get_changed_cawls(old_manifest, source_index, self.updates, hashes, target_file)
+                    )
+                    target_groups.setdefault(changed_cawls, []).append(target_file)
+                results = []
+                for changed_cawls, target_files in target_groups.items():
+                    print(
+                        f"{len(changed_cawls)} of {source_index.cawl_count} source CAWLs changed since last run "
+                        f"on {', '.join(f.name for f in target_files)}"
+                    )
+                    updater.set_source_index(source_index.subset(changed_cawls))
+                    results.extend(self.update_files(updater, target_files))
+            else:
+                results = self.update_files(updater, self.target_files)
+            self.print_summary(results)
+            if self.incremental and not self.dry_run:
+                if all(result.ok for result in results):
+                    manifest.save_manifest(
+                        self.args.incremental, self.source_index, self.updates, hashes, self.target_files
+                    )
+                    print(f"Manifest saved as \"{self.args.incremental}\"")
+                else:
+                    print("Manifest not saved because some target files failed to update")
+            if self.profiler is not None:
+                self.profiler.save(self.args.profile)
+                print(f"Profile saved as \"{self.args.profile}\"")
+
+    def run_gui(self):
+        # tkinter is only imported when the GUI is used, so that the CLI
+        #   starts faster and works without a display.
+        from tkinter import TclError
+        from tkinter import Tk
+        from . import gui
+
+        try:
+            self.root = Tk(className=self.classname)
+        except TclError as e:
+            # E.g. on a server without a display.
+            print(f"Error: the GUI can't be started: {e}")
+            exit(1)
+        self.root.title(f"Update fields in FLEx LIFT file - v{util.get_version_string()}")
+        gui.Gui(self, master=self.root, class_=self.classname)
+        self.root.mainloop()
+
+    def get_source_index(self, progress=None):
+        # Rebuild the index only if the source file or its CAWL type has changed.
+        if self.source_index is None or self.source_index.cawl_type != self.source_cawl_type:
+            with self.profile_phase('index-source'):
+                # The source files' trees are freed as they're read; all sources
+                #   are merged into one index, in order of precedence.
+                self.source_index = index.read_source_indexes(
+                    [self.source_file] + self.extra_source_files, self.source_cawl_type, progress
+                )
+            if self.debug:
+                print(f"Debug: Source index: {self.source_index}")
+        return self.source_index
+
+    def get_options(self):
+        return engine.Options(
+            glosses=self.updates.get('glosses'),
+            semantic_domain=self.updates.get('semantic-domain', False),
+            allow_overwrite=self.updates.get('allow-overwrite', False),
+            source_cawl_type=self.source_cawl_type,
+            target_cawl_type=self.target_cawl_type,
+            stream=self.stream,
+            dry_run=self.dry_run,
+            patch=self.patch,
+            compression=self.compression,
+            fallback=self.fallback,
+            fallback_threshold=self.args.fallback_threshold,
+            debug=self.debug,
+        )
+
+    def get_updater(self, progress=None):
+        # The source index is reused while the source and its CAWL type
+        #   are unchanged.
+        return engine.Updater(
+            [self.source_file] + self.extra_source_files,
+            self.get_options(),
+            source_index=self.get_source_index(progress),
+        )
+
+    def get_progress_bar(self, name):
+        if not self.progress:
+            return None
+        return progress.ProgressBar(name)
+
+    def profile_phase(self, name):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(name)
 
     def print_debug_variables(self):
         print(f"Debug: {self.args = }")
         print(f"Debug: {self.source_file = }")
+        print(f"Debug: {self.extra_source_files = }")
         print(f"Debug: {self.source_cawl_type = }")
         print(f"Debug: {self.target_cawl_type = }")
         print(f"Debug: {self.updates = }")
+        print(f"Debug: {self.stream = }")
+        print(f"Debug: {self.dry_run = }")
+        print(f"Debug: {self.patch = }")
+        print(f"Debug: {self.compression = }")
+        print(f"Debug: {self.incremental = }")
+        print(f"Debug: {self.fallback = }")
+        print(f"Debug: {self.jobs = }")
+        print(f"Debug: {self.progress = }")
         print(f"Debug: {self.target_files = }")
 
     def reset_variables(self):
         self.source_cawl_type = self.source_cawl_type_default
         self.source_file = self.source_file_default
-        self.source_xml = self.source_xml_default
+        self.extra_source_files = self.extra_source_files_default
+        self.source_index = self.source_index_default
         self.target_cawl_type = self.target_cawl_type_default
         self.target_files = self.target_files_default
-        self.target_xml = self.target_xml_default
         self.updates = self.updates_default
 
     def set_user_options(self):
         self.debug = True if self.args.debug else False
+        self.stream = True if self.args.stream else False
+        self.dry_run = True if self.args.dry_run else False
+        self.patch = True if self.args.patch else False
+        # Output compression suffix; None keeps that of each target file.
+        self.compression = None
+        if self.args.compress:
+            self.compression = '' if self.args.compress == 'none' else f".{self.args.compress}"
+        self.incremental = True if self.args.incremental else False
+        self.fallback = True if self.args.fallback else False
+        self.jobs = max(1, self.args.jobs)
+        # Progress can't be shown for files updated in worker processes.
+        self.progress = True if self.args.progress and self.jobs == 1 else False
+        self.profiler = profiling.Profiler() if self.args.profile else None
 
         # Source CAWL type.
         if self.args.source_id_type:
@@ -116,70 +235,79 @@ class App(Tk):
         else:
             self.target_cawl_type = self.target_cawl_type_default
 
-    def save_xml_to_file(self, infile_path):
-        tag = '_updated'
-        if self.updates.get('semantic-domain'):
-            tag += '-s'
-        langs = self.updates.get('glosses')
-        if langs is not None:
-            tag += '-' + '-'.join(langs)
-        outfile = util.get_outfile_object(infile_path, tag, self.debug)
-        self.target_xml.write(
-            str(outfile), encoding='UTF-8', pretty_print=True, xml_declaration=True
-        )
-        print(f"Updated file saved as \"{outfile}\"")
-
-    def update_file(self, target_file):
-        # Gather data from source and target files.
-        target_cawls_dict = util.get_cawl_dict(self.target_xml, self.target_cawl_type)
-        source_cawls_dict = util.get_cawl_dict(self.source_xml, self.source_cawl_type)
-        # Loop through dict for CAWL #s in target file (10x faster than looping through XML).
-        for cawl, target_senses in target_cawls_dict.items():
-            if cawl is None:
+    def print_summary(self, results):
+        for result in results:
+            if not result.ok:
+                print(f"{result.get_name()}: update failed")
                 continue
-            source_senses = source_cawls_dict.get(cawl, [])
-            if len(source_senses) == 0:
-                continue
-            
-            # Update glosses.
-            for lang in self.updates.get('glosses', []):
-                allow_overwrite = self.updates.get('allow-overwrite', False)
-                if lang == 'sg':
-                    print(f"Language is {lang}: automatically overwriting gloss for {cawl}")
-                    allow_overwrite = True
-                source_glosses = []
-                for sense in source_senses:
-                    # Combine source file's lexical-unit of same lang and lang's gloss.
-                    #   NOTE: Is it worth comparing with existing value before replacing?
-                    source_glosses.extend(util.get_glosses_from_sense(lang, sense))
-                source_glosses = util.normalize_list(source_glosses)
-                if len(source_glosses) > 0:
-                    for sense in target_senses:
-                        util.dedupe_glosses(lang, sense)
-                        util.update_gloss(lang, source_glosses, sense, allow_overwrite)
-
-            # Update semantic domain.
-            if self.updates.get('semantic-domain', False):
-                allow_overwrite = True # always overwrite
-                source_semantic_domains = []
-                for sense in source_senses:
-                    source_semantic_domains.extend(util.get_semantic_domains_from_sense(sense))
-                source_semantic_domains = util.normalize_list(source_semantic_domains)
-                if len(source_semantic_domains) > 0:
-                    for sense in target_senses:
-                        # Replace semantic domain value in target.
-                        #   NOTE: Is it worth comparing with existing value before replacing?
-                        #   E.g. Many files have the same SD #, but use either FR or EN text with it.
-                        util.dedupe_semantic_domains(sense)
-                        util.update_semantic_domain(source_semantic_domains, sense, allow_overwrite)
-
-        # Create updated target file, preserving original.
-        try:
-            self.save_xml_to_file(target_file)
-            return True
-        except Exception as e:
-            print(f"Error: {e}")
-            return False
+            print(engine.get_summary(result.get_name(), result.stats))
+
+    def update_files(self, updater, target_files):
+        if self.jobs > 1 and len(target_files) > 1:
+            return self.update_files_in_parallel(updater, target_files)
+        results = []
+        for target_file in target_files:
+            if self.debug:
+                print(f"Debug: {target_file = }")
+            progress_bar = self.get_progress_bar(target_file.name)
+            result = updater.update(target_file, progress=progress_bar, profiler=self.profiler)
+            if progress_bar is not None:
+                progress_bar.finish()
+            if self.debug:
+                print(f"Debug: Update {result = }")
+            results.append(result)
+        return results
+
+    def update_files_in_parallel(self, updater, target_files):
+        # Workers receive a pickled copy of the updater, whose source index
+        #   holds only normalized CAWL data, not the source lxml tree.
+        from concurrent.futures import ProcessPoolExecutor
+
+        results = []
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            if self.profiler is None:
+                futures = [executor.submit(updater.update, target_file) for target_file in target_files]
+            else:
+                futures = [
+                    executor.submit(engine.profile_update, updater, target_file)
+                    for target_file in target_files
+                ]
+            for target_file, future in zip(target_files, futures):
+                if self.profiler is None:
+                    result = future.result()
+                else:
+                    result, worker_profiler = future.result()
+                    self.profiler.merge(worker_profiler)
+                if self.debug:
+                    print(f"Debug: Update {target_file = }, {result = }")
+                results.append(result)
+        return results
+
 
 def main():
-    App(util.parse_cli(), className="Updateflex")
+    args = util.parse_cli()
+    # Commands' modules are only imported when they're used, so that updates
+    #   and -V start faster.
+    if args.command == 'apply':
+        from . import changeset
+        changeset.main(args)
+    elif args.command == 'batch':
+        from . import batch
+        batch.main(args)
+    elif args.command == 'db':
+        from . import db
+        db.main(args)
+    elif args.command == 'normalize':
+        from . import normalize
+        normalize.main(args)
+    elif args.command == 'report':
+        from . import report
+        report.main(args)
+    elif args.command == 'verify':
+        from . import verify
+        verify.main(args)
+    elif args.command == 'watch':
+        from . import watch
+        watch.main(args)
+    else:
+        App(args, className="Updateflex")
@@ -0,0 +1,206 @@
+import json
+import time
+
+from collections import Counter
+from pathlib import Path
+from sys import exit
+
+from . import engine
+from . import index
+from . import util
+
+# Job keys that can also be given at the top of the manifest as defaults.
+JOB_KEYS = [
+    'source', 'extra-source', 'targets', 'glosses', 'source-id-type', 'target-id-type',
+    'semantic-domain', 'allow-overwrite',
+]
+
+# Source indexes by (source files, CAWL type), set in each worker process.
+source_indexes = dict()
+
+
+def read_manifest(manifest_file):
+    """Read a JSON or TOML manifest; TOML needs Python 3.11 or the tomli package."""
+    manifest_file = Path(manifest_file)
+    if manifest_file.suffix == '.toml':
+        # Optional dependency before Python 3.11.
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ImportError(f"The tomli package is needed for \"{manifest_file}\"; install it with: pip install tomli")
+        with open(manifest_file, 'rb') as f:
+            return tomllib.load(f)
+    with open(manifest_file, encoding='UTF-8') as f:
+        return json.load(f)
+
+def get_jobs(manifest, base_dir):
+    """Return the manifest's jobs with defaults filled in and file paths
+    resolved relative to base_dir."""
+    defaults = {k: v for k, v in manifest.items() if k in JOB_KEYS}
+    jobs = []
+    for i, job_data in enumerate(manifest.get('jobs', []), 1):
+        unknown = [k for k in job_data if k not in JOB_KEYS]
+        if unknown:
+            raise ValueError(f"Unknown key(s) in job {i}: {', '.join(unknown)}")
+        job_data = {**defaults, **job_data}
+        if not job_data.get('source') or not job_data.get('targets'):
+            raise ValueError(f"Job {i} needs a source and targets")
+        extra_sources = job_data.get('extra-source', [])
+        if isinstance(extra_sources, str):
+            extra_sources = [extra_sources]
+        targets = job_data['targets']
+        if isinstance(targets, str):
+            targets = [targets]
+        glosses = job_data.get('glosses')
+        if isinstance(glosses, list):
+            glosses = ','.join(glosses)
+        options = engine.Options(
+            glosses=util.parse_glosses_string_to_list(glosses) if glosses else None,
+            semantic_domain=bool(job_data.get('semantic-domain')),
+            allow_overwrite=bool(job_data.get('allow-overwrite')),
+            source_cawl_type=job_data.get('source-id-type') or 'CAWL',
+            target_cawl_type=job_data.get('target-id-type') or 'CAWL',
+        )
+        jobs.append({
+            'source': tuple((base_dir / f).resolve() for f in [job_data['source']] + extra_sources),
+            'source-id-type': options.source_cawl_type,
+            'targets': [(base_dir / f).resolve() for f in targets],
+            'target-id-type': options.target_cawl_type,
+            'options': options,
+        })
+    return jobs
+
+def get_source_types(jobs):
+    # CAWL types needed for each distinct source file.
+    source_types = dict()
+    for job in jobs:
+        for source_file in job['source']:
+            source_types.setdefault(source_file, set()).add(job['source-id-type'])
+    return source_types
+
+def get_target_groups(jobs):
+    """Group the jobs' steps by target file, in manifest order, so that each
+    target is parsed and written once."""
+    groups = dict()
+    for job in jobs:
+        for target_file in job['targets']:
+            step = ((job['source'], job['source-id-type']), job['target-id-type'], job['updates'])
+            groups.setdefault(target_file, []).append(step)
+    return groups
+
+def get_group_updates(steps):
+    # Combined updates, used to name the output file.
+    updates = dict()
+    for _, _, step_updates in steps:
+        for lang in step_updates.get('glosses', []):
+            langs = updates.setdefault('glosses', [])
+            if lang not in langs:
+                langs.append(lang)
+        if step_updates.get('semantic-domain'):
+            updates['semantic-domain'] = True
+    return updates
+
+def set_source_indexes(indexes):
+    # Each worker receives the indexes once rather than with every group.
+    global source_indexes
+    source_indexes = indexes
+
+def update_target_group(target_file, steps, compression=None, debug=False):
+    """Apply each step's updates in turn to a target file, parsing and
+    writing it once, and return the result and the update stats. The stats
+    are counted as for the main command, for each step, except that a sense
+    updated by several steps is only counted once."""
+    start = time.perf_counter()
+    stats = Counter()
+    changes = []
+    updated_senses = set()
+    outfile = util.get_outfile_object(
+        target_file, util.get_outfile_tag(get_group_updates(steps)), debug, compression=compression
+    )
+    try:
+        target_xml = util.get_xml_tree(target_file)
+        cawl_dicts = dict()
+        for source_key, target_cawl_type, updates in steps:
+            if target_cawl_type not in cawl_dicts:
+                cawl_dicts[target_cawl_type] = util.get_cawl_dict(target_xml, target_cawl_type)
+            util.update_cawl_dict(
+                cawl_dicts[target_cawl_type], source_indexes[source_key], updates, stats, changes,
+                updated_senses=updated_senses,
+            )
+        if changes:
+            util.save_xml_tree(target_xml, outfile)
+            print(f"Updated file saved as \"{outfile}\"")
+        else:
+            print(f"No changes needed in \"{target_file}\"; no file written")
+        result = True
+    except Exception as e:
+        print(f"Error: {e}")
+        result = False
+    stats['time'] = time.perf_counter() - start
+    return result, stats
+
+def run_jobs(jobs, n_jobs=1, compression=None, debug=False):
+    """Parse each distinct source file once for all the CAWL types it's used
+    with, build each distinct source index once, then update each target
+    once with all of its jobs. Return the results by target file."""
+    source_types = get_source_types(jobs)
+    if n_jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {
+                f: executor.submit(index.read_source_index_types, f, sorted(types))
+                for f, types in source_types.items()
+            }
+            file_indexes = {f: future.result() for f, future in futures.items()}
+    else:
+        file_indexes = {f: index.read_source_index_types(f, sorted(types)) for f, types in source_types.items()}
+    indexes = dict()
+    for job in jobs:
+        key = (job['source'], job['source-id-type'])
+        if key not in indexes:
+            parts = [file_indexes[f][job['source-id-type']] for f in job['source']]
+            indexes[key] = index.MergedIndex(parts) if len(parts) > 1 else parts[0]
+        # Glosses default to the source's lexical-unit language, as for the main command.
+        job['updates'] = job['options'].get_source_updates(indexes[key], job['source'][0].name)
+    print(f"{len(jobs)} jobs: {len(file_indexes)} source files, {len(indexes)} source indexes")
+
+    groups = get_target_groups(jobs)
+    if n_jobs > 1 and len(groups) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=set_source_indexes, initargs=(indexes,)) as executor:
+            futures = {
+                target_file: executor.submit(update_target_group, target_file, steps, compression, debug)
+                for target_file, steps in groups.items()
+            }
+            return {target_file: future.result() for target_file, future in futures.items()}
+    set_source_indexes(indexes)
+    return {
+        target_file: update_target_group(target_file, steps, compression, debug)
+        for target_file, steps in groups.items()
+    }
+
+def main(args):
+    manifest_file = Path(args.manifest).resolve()
+    try:
+        jobs = get_jobs(read_manifest(manifest_file), manifest_file.parent)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Error: {e}")
+        exit(1)
+    compression = args.compress
+    if compression is not None:
+        compression = '' if compression == 'none' else f".{compression}"
+    try:
+        results = run_jobs(jobs, args.jobs, compression, args.debug)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
+    for target_file, (result, stats) in results.items():
+        if result:
+            print(engine.get_summary(target_file.name, stats))
+    if not all(result for result, _ in results.values()):
+        exit(1)
@@ -0,0 +1,111 @@
+import json
+
+from collections import Counter
+from lxml import etree
+from pathlib import Path
+from sys import exit
+
+from . import util
+
+
+def save_changeset(outfile_obj, target_file, updates, changes):
+    # Changes to senses that can't be identified couldn't be applied reliably.
+    unidentified = sum(1 for change in changes if change['sense'] is None)
+    if unidentified:
+        print(f"Warning: {unidentified} changes to senses without an id in entries without a guid or id were left out")
+    changeset = {
+        'target': Path(target_file).name,
+        'tag': util.get_outfile_tag(updates),
+        'updates': updates,
+        'changes': [change for change in changes if change['sense'] is not None],
+    }
+    with open(outfile_obj, 'w', encoding='UTF-8') as f:
+        json.dump(changeset, f, ensure_ascii=False, separators=(',', ':'))
+
+def load_changeset(infile_obj):
+    with open(infile_obj, encoding='UTF-8') as f:
+        return json.load(f)
+
+def get_field_elements(sense, change):
+    if change['field'] == 'gloss':
+        return [g for g in sense.findall('gloss') if g.get('lang') == change.get('lang')]
+    return [t for t in sense.findall('trait') if t.get('name') == change['field']]
+
+def apply_change(sense, change):
+    """Set the sense's field to the changeset's new value if its current value
+    still matches the old one; return True if the change was applied."""
+    elements = get_field_elements(sense, change)
+    if change['field'] == 'gloss':
+        current = [e.find('text').text for e in elements]
+    else:
+        current = [e.get('value') for e in elements]
+    if current != change['old']:
+        return False
+
+    for i, new_text in enumerate(change['new']):
+        if change['field'] == 'gloss':
+            if i < len(elements):
+                elements[i].find('text').text = new_text
+            else:
+                gloss = etree.SubElement(sense, 'gloss')
+                gloss.attrib['lang'] = change['lang']
+                gloss_text = etree.SubElement(gloss, 'text')
+                gloss_text.text = new_text
+        else:
+            if i < len(elements):
+                elements[i].attrib['value'] = new_text
+            else:
+                trait = etree.SubElement(sense, 'trait')
+                trait.attrib['name'] = change['field']
+                trait.attrib['value'] = new_text
+    # Remove any deduplicated elements.
+    for elem in elements[len(change['new']):]:
+        sense.remove(elem)
+    util.update_timestamps(sense)
+    return True
+
+def apply_changeset(changeset, target_file, outfile_obj):
+    """Stream the target file to outfile_obj, applying the changeset's changes
+    to the matching senses, and return counts of applied and conflicting
+    changes and of senses not found."""
+    changes_by_sense = dict()
+    for change in changeset['changes']:
+        changes_by_sense.setdefault(change['sense'], []).append(change)
+    found = set()
+    stats = Counter()
+
+    def apply_to_entry(entry):
+        for sense in entry.iter('sense'):
+            key = util.get_sense_key(sense)
+            # Each sense's changes are applied once, even if its key is repeated.
+            if key not in changes_by_sense or key in found:
+                continue
+            found.add(key)
+            for change in changes_by_sense[key]:
+                if apply_change(sense, change):
+                    stats['applied'] += 1
+                else:
+                    stats['conflicts'] += 1
+                    print(f"Conflict: {change['field']} of sense {change['sense']} has changed; skipped")
+
+    util.stream_xml_file(target_file, outfile_obj, apply_to_entry)
+    stats['not-found'] = len(changes_by_sense) - len(found)
+    return stats
+
+def main(args):
+    changeset_file = Path(args.changeset).resolve()
+    target_file = Path(args.target_db).resolve()
+    changeset = load_changeset(changeset_file)
+    if changeset['target'] != target_file.name:
+        print(f"Warning: changeset was made for \"{changeset['target']}\"")
+    outfile = util.get_outfile_object(target_file, changeset['tag'], args.debug)
+    try:
+        stats = apply_changeset(changeset, target_file, outfile)
+    except (OSError, etree.XMLSyntaxError) as e:
+        print(f"Error: {e}")
+        exit(1)
+    print(f"Updated file saved as \"{outfile}\"")
+    print(
+        f"{target_file.name}: {stats['applied']} changes applied, "
+        f"{stats['conflicts']} conflicts, {stats['not-found']} senses not found"
+    )
@@ -0,0 +1,311 @@
+import datetime
+import json
+import sqlite3
+import time
+
+from collections import Counter
+from lxml import etree
+from pathlib import Path
+from sys import exit
+
+from . import engine
+from . import index
+from . import util
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE elements (pos INTEGER PRIMARY KEY, tag TEXT, xml BLOB, dirty INTEGER DEFAULT 0);
+CREATE TABLE senses (
+    id INTEGER PRIMARY KEY, element_pos INTEGER, seq INTEGER, sense_id TEXT, cawl TEXT, date_modified TEXT
+);
+CREATE TABLE glosses (sense INTEGER, lang TEXT, seq INTEGER, text TEXT);
+CREATE TABLE semantic_domains (sense INTEGER, seq INTEGER, value TEXT);
+CREATE INDEX senses_cawl ON senses (cawl);
+CREATE INDEX senses_sense_id ON senses (sense_id);
+CREATE INDEX glosses_sense_lang ON glosses (sense, lang);
+CREATE INDEX glosses_lang ON glosses (lang);
+CREATE INDEX semantic_domains_sense ON semantic_domains (sense);
+'''
+
+
+def connect(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.create_function('normalize_terms', 1, util.normalize_text, deterministic=True)
+    return conn
+
+def get_meta(conn, key):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row is not None else None
+
+def set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, json.dumps(value, ensure_ascii=False)))
+
+def import_entry(conn, pos, entry, cawl_type):
+    sense_cawls = dict()
+    for cawl, senses in util.get_cawl_dict(entry, cawl_type).items():
+        for sense in senses:
+            sense_cawls[sense] = cawl
+    for seq, sense in enumerate(entry.iter('sense')):
+        cursor = conn.execute(
+            'INSERT INTO senses (element_pos, seq, sense_id, cawl) VALUES (?, ?, ?, ?)',
+            (pos, seq, sense.get('id'), sense_cawls.get(sense)),
+        )
+        sense_row = cursor.lastrowid
+        gloss_seqs = Counter()
+        sd_seq = 0
+        # Glosses without text and traits without a value are left as they
+        #   are in the XML, as in apply_db_values.
+        for child in sense.iterchildren('gloss', 'trait'):
+            if child.tag == 'gloss':
+                if child.findtext('text') is None:
+                    continue
+                lang = child.get('lang')
+                conn.execute(
+                    'INSERT INTO glosses VALUES (?, ?, ?, ?)',
+                    (sense_row, lang, gloss_seqs[lang], child.findtext('text')),
+                )
+                gloss_seqs[lang] += 1
+            elif child.get('name') == 'semantic-domain-ddp4' and child.get('value') is not None:
+                conn.execute('INSERT INTO semantic_domains VALUES (?, ?, ?)', (sense_row, sd_seq, child.get('value')))
+                sd_seq += 1
+
+def import_lift(lift_file, db_file, cawl_type):
+    """Stream a LIFT file into a new database: each top-level element is
+    kept as XML, and the senses' CAWLs, glosses and semantic domains are
+    kept in indexed tables."""
+    with connect(db_file) as conn:
+        conn.executescript(SCHEMA)
+        set_meta(conn, 'cawl-type', cawl_type)
+        set_meta(conn, 'file', Path(lift_file).name)
+        prolog = []
+        pos = 0
+        for kind, elem in util.iter_xml_file(lift_file):
+            if kind in ('comment', 'pi'):
+                prolog.append(etree.tostring(elem).decode('UTF-8'))
+            elif kind == 'root':
+                set_meta(conn, 'root', {'tag': elem.tag, 'attrib': dict(elem.attrib), 'nsmap': elem.nsmap})
+            else:
+                # Comments and processing instructions are kept without a tag.
+                tag = elem.tag if isinstance(elem.tag, str) else None
+                conn.execute('INSERT INTO elements (pos, tag, xml) VALUES (?, ?, ?)', (pos, tag, etree.tostring(elem)))
+                if elem.tag == 'entry':
+                    import_entry(conn, pos, elem, cawl_type)
+                pos += 1
+        set_meta(conn, 'prolog', prolog)
+    conn.close()
+    return pos
+
+def load_source_values(conn, source_index, field, lang=None):
+    # Joined source values of the database's CAWLs that are in the source.
+    conn.execute('DROP TABLE IF EXISTS temp.src')
+    conn.execute('CREATE TEMP TABLE src (cawl TEXT PRIMARY KEY, text TEXT)')
+    rows = []
+    for (cawl,) in conn.execute('SELECT DISTINCT cawl FROM senses WHERE cawl IS NOT NULL'):
+        if cawl not in source_index:
+            continue
+        if field == 'gloss':
+            values = source_index.get_glosses(cawl, lang)
+        else:
+            values = source_index.get_semantic_domains(cawl)
+        if values:
+            rows.append((cawl, ' ; '.join(values)))
+    conn.executemany('INSERT INTO src VALUES (?, ?)', rows)
+    # Matched senses with the value they'll get.
+    conn.execute('DROP TABLE IF EXISTS temp.m')
+    conn.execute('''
+        CREATE TEMP TABLE m AS
+        SELECT s.id AS sense, src.text AS text FROM senses s JOIN src ON s.cawl = src.cawl
+    ''')
+    conn.execute('CREATE INDEX temp.m_sense ON m (sense)')
+
+def update_field(conn, table, value_col, where, params, allow_overwrite, stats, keys):
+    """Dedupe, overwrite and create one field (a gloss language or the
+    semantic domain) of the matched senses in table as set-based statements,
+    with the same results as dedupe_glosses and update_gloss."""
+    # Merge multiple elements of the field into the 1st one.
+    rows = conn.execute(f'''
+        SELECT t.rowid, t.sense, t.{value_col} FROM {table} t
+        WHERE {where} AND t.sense IN (SELECT sense FROM m)
+        AND t.sense IN (SELECT sense FROM {table} t WHERE {where} GROUP BY sense HAVING count(*) > 1)
+        ORDER BY t.sense, t.seq
+    ''', params * 2).fetchall()
+    groups = dict()
+    for rowid, sense, value in rows:
+        groups.setdefault(sense, []).append((rowid, value))
+    for sense, group in groups.items():
+        conn.execute(
+            f'UPDATE {table} SET {value_col} = ? WHERE rowid = ?',
+            (util.join_terms([value for _, value in group]), group[0][0]),
+        )
+        conn.executemany(f'DELETE FROM {table} WHERE rowid = ?', [(rowid,) for rowid, _ in group[1:]])
+        conn.execute('INSERT OR IGNORE INTO dirty VALUES (?)', (sense,))
+        stats[keys['deduped']] += len(group) - 1
+    # Normalize single elements.
+    changed = f'''
+        FROM {table} t WHERE {where} AND t.sense IN (SELECT sense FROM m)
+        AND t.{value_col} IS NOT NULL AND t.{value_col} IS NOT normalize_terms(t.{value_col})
+    '''
+    conn.execute(f'INSERT OR IGNORE INTO dirty SELECT t.sense {changed}', params)
+    conn.execute(f'UPDATE {table} SET {value_col} = normalize_terms({value_col}) WHERE rowid IN (SELECT t.rowid {changed})', params)
+
+    # Overwrite existing values.
+    existing = f'FROM {table} t JOIN m ON t.sense = m.sense WHERE {where}'
+    if allow_overwrite:
+        overwritten = f'{existing} AND t.{value_col} IS NOT m.text'
+        stats[keys['overwritten']] += conn.execute(f'SELECT count(*) {overwritten}', params).fetchone()[0]
+        conn.execute(f'INSERT OR IGNORE INTO updated SELECT t.sense {overwritten}', params)
+        conn.execute(f'''
+            UPDATE {table} SET {value_col} = (SELECT text FROM m WHERE m.sense = {table}.sense)
+            WHERE rowid IN (SELECT t.rowid {overwritten})
+        ''', params)
+    else:
+        stats[keys['skipped']] += conn.execute(f'SELECT count(*) {existing}', params).fetchone()[0]
+
+    # Create missing values.
+    missing = f'FROM m WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.sense = m.sense AND {where})'
+    conn.execute(f'INSERT OR IGNORE INTO updated SELECT m.sense {missing}', params)
+    if table == 'glosses':
+        n = conn.execute(f'INSERT INTO glosses SELECT m.sense, ?, 0, m.text {missing}', params * 2).rowcount
+    else:
+        n = conn.execute(f'INSERT INTO semantic_domains SELECT m.sense, 0, m.text {missing}', params).rowcount
+    stats[keys['created']] += n
+
+def update_db(db_file, source_index, updates):
+    """Update the database's senses from the source index and return the
+    update stats, counted as for LIFT files."""
+    start = time.perf_counter()
+    stats = Counter()
+    with connect(db_file) as conn:
+        conn.execute('CREATE TEMP TABLE dirty (sense INTEGER PRIMARY KEY)')
+        conn.execute('CREATE TEMP TABLE updated (sense INTEGER PRIMARY KEY)')
+        for lang in updates.get('glosses', []):
+            allow_overwrite = updates.get('allow-overwrite', False)
+            if lang == 'sg':
+                print(f"Language is {lang}: automatically overwriting glosses")
+                allow_overwrite = True
+            load_source_values(conn, source_index, 'gloss', lang)
+            update_field(
+                conn, 'glosses', 'text', 't.lang = ?', (lang,), allow_overwrite, stats,
+                {'deduped': 'glosses-deduped', 'overwritten': 'glosses-overwritten',
+                 'skipped': 'glosses-skipped', 'created': 'glosses-added'},
+            )
+        if updates.get('semantic-domain', False):
+            load_source_values(conn, source_index, 'semantic-domain')
+            # Always overwrite.
+            update_field(
+                conn, 'semantic_domains', 'value', '1', (), True, stats,
+                {'deduped': 'semantic-domains-deduped', 'overwritten': 'semantic-domains-replaced',
+                 'skipped': 'semantic-domains-skipped', 'created': 'semantic-domains-replaced'},
+            )
+
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        timestamp = now_utc.strftime('%Y-%m-%dT%H:%M:%SZ')
+        stats['senses-updated'] = conn.execute('SELECT count(*) FROM updated').fetchone()[0]
+        conn.execute('UPDATE senses SET date_modified = ? WHERE id IN (SELECT sense FROM updated)', (timestamp,))
+        conn.execute('''
+            UPDATE elements SET dirty = 1 WHERE pos IN (
+                SELECT element_pos FROM senses WHERE id IN (SELECT sense FROM dirty UNION SELECT sense FROM updated)
+            )
+        ''')
+    conn.close()
+    stats['time'] = time.perf_counter() - start
+    return stats
+
+def set_elements(sense, tag, values, get_value, set_value, new_element):
+    # Give the matching child elements the database's values, adding or
+    #   removing elements as needed.
+    elements = [e for e in sense.iterchildren(tag) if get_value(e) is not None]
+    for i, value in enumerate(values):
+        if i < len(elements):
+            if get_value(e := elements[i]) != value:
+                set_value(e, value)
+        else:
+            set_value(new_element(), value)
+    for elem in elements[len(values):]:
+        sense.remove(elem)
+
+def apply_db_values(conn, pos, entry):
+    senses = list(entry.iter('sense'))
+    rows = conn.execute('SELECT id, seq, date_modified FROM senses WHERE element_pos = ?', (pos,)).fetchall()
+    for sense_row, seq, date_modified in rows:
+        sense = senses[seq]
+        glosses = dict()
+        for lang, text in conn.execute('SELECT lang, text FROM glosses WHERE sense = ? ORDER BY seq', (sense_row,)):
+            glosses.setdefault(lang, []).append(text)
+        for g in sense.iterchildren('gloss'):
+            glosses.setdefault(g.get('lang'), [])
+        for lang, texts in glosses.items():
+            def new_gloss(lang=lang):
+                gloss = etree.SubElement(sense, 'gloss')
+                gloss.attrib['lang'] = lang
+                etree.SubElement(gloss, 'text')
+                return gloss
+            set_elements(
+                sense, 'gloss', texts,
+                lambda e, lang=lang: e.findtext('text') if e.get('lang') == lang else None,
+                lambda e, text: setattr(e.find('text'), 'text', text),
+                new_gloss,
+            )
+        values = [v for (v,) in conn.execute('SELECT value FROM semantic_domains WHERE sense = ? ORDER BY seq', (sense_row,))]
+
+        def new_trait():
+            trait = etree.SubElement(sense, 'trait')
+            trait.attrib['name'] = 'semantic-domain-ddp4'
+            return trait
+        set_elements(
+            sense, 'trait', values,
+            lambda e: e.get('value') if e.get('name') == 'semantic-domain-ddp4' else None,
+            lambda e, value: e.set('value', value),
+            new_trait,
+        )
+        if date_modified is not None:
+            sense.attrib['dateModified'] = date_modified
+            sense.getparent().attrib['dateModified'] = date_modified
+
+def export_lift(db_file, outfile_obj):
+    """Write the database as a LIFT file one top-level element at a time,
+    laid out as the whole tree would be printed."""
+    parser = etree.XMLParser(remove_blank_text=True)
+    with connect(db_file) as conn:
+        root = get_meta(conn, 'root')
+        wrapper, start, end = util.get_xml_wrapper(
+            etree.Element(root['tag'], root['attrib'], nsmap=root['nsmap'] or None)
+        )
+        with util.open_output_file(outfile_obj) as f:
+            f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+            for xml in get_meta(conn, 'prolog'):
+                f.write(xml.encode('UTF-8') + b'\n')
+            f.write(start)
+            for pos, xml, dirty in conn.execute('SELECT pos, xml, dirty FROM elements ORDER BY pos'):
+                elem = util.bytes_to_xml_child(xml, parser)
+                if dirty:
+                    apply_db_values(conn, pos, elem)
+                f.write(util.format_xml_child(wrapper, start, end, elem))
+            f.write(end)
+    conn.close()
+
+def main(args):
+    db_file = Path(args.db).resolve()
+    if args.action == 'import':
+        if db_file.exists():
+            db_file.unlink()
+        n = import_lift(Path(args.lift).resolve(), db_file, args.target_id_type or 'CAWL')
+        print(f"Imported {n} elements into \"{db_file}\"")
+        return
+    if not db_file.is_file():
+        print(f"ERROR: Database not found: {db_file}")
+        exit(1)
+    if args.action == 'update':
+        source_files = [Path(f).resolve() for f in [args.source_db] + (args.extra_source or [])]
+        options = engine.Options.from_args(args)
+        source_index = index.read_source_indexes(source_files, options.source_cawl_type)
+        try:
+            updates = options.get_source_updates(source_index, source_files[0].name)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            exit(1)
+        stats = update_db(db_file, source_index, updates)
+        print(engine.get_summary(db_file.name, stats))
+    elif args.action == 'export':
+        export_lift(db_file, Path(args.outfile))
+        print(f"Database exported as \"{args.outfile}\"")
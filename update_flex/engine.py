@@ -0,0 +1,423 @@
+import csv
+import os
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from contextlib import nullcontext
+from lxml import etree
+from pathlib import Path
+
+from . import changeset
+from . import fallback
+from . import index
+from . import profiling
+from . import util
+
+
+def get_name(file_obj):
+    # How a source or target is named in messages.
+    if isinstance(file_obj, (str, os.PathLike)):
+        return Path(file_obj).name
+    return '<data>'
+
+def get_summary(name, stats):
+    # One line of update counts, as printed by each command.
+    return (
+        f"{name}: {stats['senses-updated']} senses updated, "
+        f"{stats['glosses-added']} glosses added, "
+        f"{stats['glosses-overwritten']} glosses overwritten, "
+        f"{stats['semantic-domains-replaced']} semantic domains replaced "
+        f"in {stats['time']:.2f}s"
+    )
+
+
+class Cancelled(Exception):
+    """Raised by a progress callback to stop an update. Unlike other errors,
+    it isn't reported in the Result but passed on to the caller."""
+
+
+class Options:
+    """What to update in each target and how its file is read and written.
+
+    glosses is a list of languages; if neither it nor semantic_domain is
+    given, the glosses of the source's lexical-unit language are updated.
+    """
+    def __init__(
+        self, glosses=None, semantic_domain=False, allow_overwrite=False,
+        source_cawl_type='CAWL', target_cawl_type='CAWL', stream=False, dry_run=False, patch=False,
+        compression=None, fallback=False, fallback_threshold=0.8, debug=False,
+    ):
+        self.glosses = list(glosses) if glosses else None
+        self.semantic_domain = semantic_domain
+        self.allow_overwrite = allow_overwrite
+        self.source_cawl_type = source_cawl_type
+        self.target_cawl_type = target_cawl_type
+        self.stream = stream
+        self.dry_run = dry_run
+        self.patch = patch
+        # Output compression suffix; None keeps that of each target file.
+        self.compression = compression
+        self.fallback = fallback
+        self.fallback_threshold = fallback_threshold
+        self.debug = debug
+
+    @classmethod
+    def from_args(cls, args):
+        """Options from a command's parsed arguments; those the command
+        doesn't have keep their defaults."""
+        glosses = getattr(args, 'glosses', None)
+        return cls(
+            glosses=util.parse_glosses_string_to_list(glosses) if glosses else None,
+            semantic_domain=bool(getattr(args, 'semantic_domain', False)),
+            allow_overwrite=bool(getattr(args, 'allow_overwrite', False)),
+            source_cawl_type=getattr(args, 'source_id_type', None) or 'CAWL',
+            target_cawl_type=getattr(args, 'target_id_type', None) or 'CAWL',
+            stream=bool(getattr(args, 'stream', False)),
+            patch=bool(getattr(args, 'patch', False)),
+            debug=bool(getattr(args, 'debug', False)),
+        )
+
+    def __repr__(self):
+        return f"Options({', '.join(f'{k}={v!r}' for k, v in vars(self).items())})"
+
+    def get_updates(self, lx_lang=None):
+        # The updates dict used by util's update functions.
+        updates = dict()
+        if self.glosses:
+            updates['glosses'] = list(self.glosses)
+        if self.semantic_domain:
+            updates['semantic-domain'] = True
+        if self.allow_overwrite:
+            updates['allow-overwrite'] = True
+        if updates.get('glosses') is None and not updates.get('semantic-domain'):
+            if not lx_lang:
+                return None
+            updates['glosses'] = [lx_lang]
+        return updates
+
+    def get_source_updates(self, source_index, source_name):
+        """Return the updates to make from a source index. Raises ValueError
+        if they can't be determined."""
+        updates = self.get_updates(source_index.lx_lang)
+        if updates is None:
+            raise ValueError(f"Source language not found in {source_name}")
+        return updates
+
+
+class Result:
+    """Outcome of updating one target: whether it succeeded, where the output
+    went, the update counts and the seconds spent in each phase."""
+    def __init__(self, target):
+        self.target = target
+        self.ok = False
+        self.error = None
+        # Path of the file written, if any.
+        self.outfile = None
+        # Updated LIFT data, for a target given as data without an outfile.
+        self.output = None
+        self.stats = Counter()
+        self.timings = dict()
+        # Changes made (or that would be made, with dry_run) and fallback matches.
+        self.changes = []
+        self.matches = []
+
+    def __repr__(self):
+        return f"<Result {self.get_name()}: ok={self.ok}, {self.stats['senses-updated']} senses updated>"
+
+    @property
+    def time(self):
+        return self.stats['time']
+
+    def get_name(self):
+        return get_name(self.target)
+
+    def to_dict(self):
+        return {
+            'target': str(self.target) if isinstance(self.target, (str, os.PathLike)) else None,
+            'ok': self.ok,
+            'error': self.error,
+            'outfile': str(self.outfile) if self.outfile is not None else None,
+            'stats': dict(self.stats),
+            'timings': self.timings,
+        }
+
+
+class Updater:
+    """Headless update engine.
+
+    Sources and targets can be paths, bytes or binary file objects. The source
+    index is built once, on first use or by load_source, and is only read
+    after that, so update can be called from several threads at once; each
+    call works on its own tree and Result.
+    """
+    def __init__(self, sources, options=None, source_index=None):
+        if isinstance(sources, (str, bytes, os.PathLike)) or hasattr(sources, 'read'):
+            sources = [sources]
+        self.sources = list(sources)
+        self.options = options if options is not None else Options()
+        self.source_index = None
+        self.updates = None
+        self.fallback_index = None
+        self._lock = threading.Lock()
+        if source_index is not None:
+            self.set_source_index(source_index)
+
+    def __getstate__(self):
+        # Locks can't be pickled, e.g. to send the updater to worker processes.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def set_source_index(self, source_index):
+        """Use an index that's already built, e.g. a subset of a previous one.
+        Raises ValueError if the updates can't be determined."""
+        updates = self.options.get_source_updates(
+            source_index, get_name(self.sources[0]) if self.sources else 'source'
+        )
+        fallback_index = None
+        if self.options.fallback:
+            # Senses without a CAWL can be matched by their text instead.
+            fallback_index = fallback.FallbackIndex(source_index, self.options.fallback_threshold)
+        self.source_index = source_index
+        self.fallback_index = fallback_index
+        self.updates = updates
+
+    def load_source(self, progress=None):
+        """Index the source(s) unless that's already done, and return the index."""
+        with self._lock:
+            if self.source_index is None:
+                sources = [Path(s) if isinstance(s, (str, os.PathLike)) else s for s in self.sources]
+                self.set_source_index(
+                    index.read_source_indexes(sources, self.options.source_cawl_type, progress)
+                )
+        return self.source_index
+
+    def update(self, target, outfile=None, progress=None, profiler=None):
+        """Update a target and return a Result.
+
+        A target path is updated as update_target_file does, next to the
+        original. For target data, the updated LIFT data goes to outfile (a
+        path or a binary file object) or, if it's None, to Result.output.
+        Errors with the target are reported in the Result rather than
+        raised; errors loading the source are raised.
+        """
+        self.load_source()
+        options = self.options
+        if isinstance(target, (str, os.PathLike)):
+            return update_target_file(
+                Path(target),
+                self.source_index,
+                options.target_cawl_type,
+                self.updates,
+                stream=options.stream,
+                dry_run=options.dry_run,
+                patch=options.patch,
+                compression=options.compression,
+                fallback=self.fallback_index,
+                debug=options.debug,
+                profiler=profiler,
+                progress=progress,
+            )
+        return update_target_data(
+            target,
+            outfile,
+            self.source_index,
+            options.target_cawl_type,
+            self.updates,
+            dry_run=options.dry_run,
+            fallback=self.fallback_index,
+            progress=progress,
+        )
+
+
+@contextmanager
+def phase(name, result, profiler=None):
+    # Time a phase into the result, and the profiler if there is one.
+    start = time.perf_counter()
+    context = nullcontext() if profiler is None else profiler.phase(name, result.target)
+    try:
+        with context:
+            yield
+    finally:
+        result.timings[name] = result.timings.get(name, 0) + round(time.perf_counter() - start, 4)
+
+def update_tree(xml_tree, source_index, target_cawl_type, updates, result, fallback_index=None, progress=None, profiler=None):
+    with phase('index', result, profiler):
+        target_cawls_dict = util.get_cawl_dict(xml_tree, target_cawl_type)
+    with phase('update', result, profiler):
+        util.update_cawl_dict(target_cawls_dict, source_index, updates, result.stats, result.changes, progress)
+    if fallback_index is not None:
+        with phase('fallback', result, profiler):
+            util.update_fallback_senses(
+                target_cawls_dict.get(None, []), fallback_index, source_index, updates,
+                result.stats, result.changes, result.matches,
+            )
+
+def update_target_data(
+    target, outfile, source_index, target_cawl_type, updates,
+    dry_run=False, fallback=None, progress=None,
+):
+    """Update LIFT data given as bytes or a binary file object, and return a
+    Result. The output goes to outfile, or to Result.output if it's None; with
+    dry_run, nothing is written and the changes are only in the Result."""
+    start = time.perf_counter()
+    result = Result(target)
+    try:
+        with phase('parse', result):
+            target_xml = util.get_xml_tree(target, progress)
+        update_tree(target_xml, source_index, target_cawl_type, updates, result, fallback, progress)
+        if not dry_run:
+            with phase('save', result):
+                if outfile is None:
+                    result.output = etree.tostring(target_xml, encoding='UTF-8', pretty_print=True, xml_declaration=True)
+                elif isinstance(outfile, (str, os.PathLike)):
+                    result.outfile = Path(outfile)
+                    util.save_xml_tree(target_xml, result.outfile, progress)
+                else:
+                    target_xml.write(outfile, encoding='UTF-8', pretty_print=True, xml_declaration=True)
+        result.ok = True
+    except Cancelled:
+        raise
+    except Exception as e:
+        result.error = str(e)
+    result.stats['time'] = time.perf_counter() - start
+    return result
+
+def update_target_file(
+    target_file, source_index, target_cawl_type, updates,
+    stream=False, dry_run=False, patch=False, compression=None, fallback=None, debug=False, profiler=None,
+    progress=None,
+):
+    """Update a single target file, preserving the original, and return a
+    Result.
+
+    No file is written if nothing changed. With dry_run, the changes are saved
+    as a changeset file instead. With patch, only changed entries are
+    re-serialized; everything else is copied from the original file. The
+    output is compressed like the target unless compression is given. If a
+    fallback.FallbackIndex is given, senses without a CAWL are matched through
+    it and the matches are saved as a CSV file. If a profiling.Profiler is
+    given, each phase is recorded in it along with the update stats. If given,
+    progress is called as progress(stage, done, total) while the target is
+    parsed ('parse', in bytes), updated ('update', in CAWLs) and written
+    ('write', in bytes); when streaming, only bytes parsed are reported.
+    """
+    start = time.perf_counter()
+    result = Result(target_file)
+    stats = result.stats
+    # Changes are always recorded to know if and where the file has changed.
+    changes = result.changes
+    # Serialized changed entries, by entry position, for patching.
+    replacements = dict()
+    # Fallback matches of senses without a CAWL.
+    matches = result.matches
+    # CAWLs matched so far when streaming, so that each is counted once.
+    cawls_matched = set()
+    tag = util.get_outfile_tag(updates)
+    if dry_run:
+        outfile = util.get_outfile_object(target_file, f"{tag}_changes", debug, suffix='.json')
+    else:
+        outfile = util.get_outfile_object(target_file, tag, debug, compression=compression)
+
+    def update_entry(entry):
+        n_changes = len(changes)
+        util.update_entry(
+            entry, target_cawl_type, source_index, updates, stats, changes, fallback, matches, cawls_matched
+        )
+        if patch and len(changes) > n_changes:
+            replacements[stats['entries']] = util.xml_entry_to_bytes(entry)
+        stats['entries'] += 1
+
+    try:
+        if stream:
+            # Target entries are updated and written one at a time so that
+            #   memory use doesn't grow with the size of the file.
+            with phase('stream-update', result, profiler):
+                if dry_run or patch:
+                    for entry in util.iter_xml_entries(target_file, progress):
+                        update_entry(entry)
+                else:
+                    with util.temporary_outfile(outfile) as part_file:
+                        with util.open_lift_file(part_file, 'wb') as f:
+                            util.format_xml_file(target_file, f, progress, update_entry)
+                        if not changes:
+                            # An existing outfile is left as it is, as in
+                            #   tree mode.
+                            part_file.unlink()
+        else:
+            with phase('parse', result, profiler):
+                target_xml = util.get_xml_tree(target_file, progress)
+            update_tree(target_xml, source_index, target_cawl_type, updates, result, fallback, progress, profiler)
+            if patch and changes:
+                changed_senses = {change['sense'] for change in changes}
+                for i, entry in enumerate(target_xml.getroot().iterchildren('entry')):
+                    stats['entries'] += 1
+                    # Senses that can't be identified have the key None,
+                    #   so their entries are always re-serialized.
+                    if any(util.get_sense_key(s) in changed_senses for s in entry.iter('sense')):
+                        replacements[i] = util.xml_entry_to_bytes(entry)
+
+        if dry_run:
+            changeset.save_changeset(outfile, target_file, updates, changes)
+            result.outfile = outfile
+            print(f"Changeset saved as \"{outfile}\"")
+        elif not changes:
+            print(f"No changes needed in \"{target_file}\"; no file written")
+        else:
+            if patch:
+                with phase('patch', result, profiler):
+                    patched = util.patch_xml_file(target_file, outfile, replacements, stats['entries'])
+                if not patched:
+                    print(f"Entries couldn't be located in \"{target_file}\"; writing whole file")
+            if stream and patch and not patched:
+                with phase('stream-update', result, profiler):
+                    util.stream_xml_file(
+                        target_file,
+                        outfile,
+                        lambda entry: util.update_entry(entry, target_cawl_type, source_index, updates, fallback=fallback),
+                        progress,
+                    )
+            elif not stream and not (patch and patched):
+                with phase('save', result, profiler):
+                    util.save_xml_tree(target_xml, outfile, progress, util.get_size_hint(target_file))
+            result.outfile = outfile
+            print(f"Updated file saved as \"{outfile}\"")
+        if fallback is not None:
+            matches_file = util.get_outfile_object(target_file, f"{tag}_fallback", debug, suffix='.csv')
+            save_fallback_matches(matches_file, matches)
+            print(
+                f"{stats['fallback-matched']} of {stats['fallback-matched'] + stats['fallback-unmatched']} "
+                f"senses without a CAWL matched; matches saved as \"{matches_file}\""
+            )
+        result.ok = True
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"Error: {e}")
+        result.error = str(e)
+    del stats['entries']
+    stats['time'] = time.perf_counter() - start
+    if profiler is not None:
+        profiler.add_counters(target_file, stats)
+    if not dry_run:
+        # Changes are only kept for dry runs, so that results stay small.
+        result.changes = []
+    return result
+
+def save_fallback_matches(outfile, matches):
+    with open(outfile, 'w', encoding='UTF-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['sense', 'cawl', 'confidence', 'method', 'key'])
+        writer.writeheader()
+        writer.writerows(matches)
+
+def profile_update(updater, target):
+    # Profile in a worker process and return the profiler with the result.
+    profiler = profiling.Profiler()
+    result = updater.update(target, profiler=profiler)
+    return result, profiler
@@ -0,0 +1,148 @@
+import math
+import re
+
+from . import index
+from . import util
+
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize_key(text):
+    # Case, punctuation and spacing are ignored.
+    return NON_WORD_RE.sub(' ', text.casefold()).strip()
+
+def get_trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def get_sense_keys(sense):
+    """Return the (lang, normalized text) keys that a sense can be matched on:
+    its entry's lexical-unit, for a top-level sense, and its glosses and
+    their terms."""
+    texts = []
+    parent = sense.getparent()
+    if parent is not None and parent.tag == 'entry':
+        lexical_unit = index.get_lexical_unit(parent)
+        if lexical_unit is not None:
+            texts.append(lexical_unit)
+    for gloss in sense.iterchildren('gloss'):
+        texts.append((gloss.get('lang', ''), gloss.findtext('text')))
+    return get_keys(texts)
+
+def get_keys(texts):
+    keys = []
+    for lang, text in texts:
+        if text is None:
+            continue
+        for t in (text,) + util.split_text(text):
+            key = (lang, normalize_key(t))
+            if key[1] and key not in keys:
+                keys.append(key)
+    return keys
+
+
+class FallbackIndex:
+    """Index of a source's CAWLs by normalized lexical-unit and gloss text,
+    for target senses that have no CAWL.
+
+    Exact keys are looked up in a hash table. Otherwise candidate keys are
+    found through an inverted index of character trigrams and ranked by
+    Dice similarity, so that a sense is never compared with every source key.
+    """
+    def __init__(self, source_index, threshold=0.8):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Fallback threshold must be greater than 0 and at most 1: {threshold}")
+        self.threshold = threshold
+        # CAWLs by key; a key's CAWLs are kept as dict keys to stay ordered.
+        self.cawls = dict()
+        for cawl, records in source_index.senses.items():
+            for record in records:
+                texts = list(record.glosses)
+                if record.lexical_unit is not None:
+                    texts.append(record.lexical_unit)
+                for key in get_keys(texts):
+                    self.cawls.setdefault(key, dict())[cawl] = None
+        # A key shared by more than max_cawls CAWLs can't give a match with
+        #   enough confidence, so only the others are indexed by trigram.
+        self.max_cawls = max(1, math.floor(1 / threshold))
+        self.keys = []
+        self.key_trigrams = []
+        # Key numbers by (lang, trigram).
+        self.postings = dict()
+        for key, cawls in self.cawls.items():
+            if len(cawls) <= self.max_cawls:
+                self.add_trigrams(key)
+
+    def __str__(self):
+        return f"{len(self.cawls)} fallback keys, threshold {self.threshold}"
+
+    def add_trigrams(self, key):
+        lang, text = key
+        trigrams = get_trigrams(text)
+        n = len(self.keys)
+        self.keys.append(key)
+        self.key_trigrams.append(trigrams)
+        for trigram in trigrams:
+            self.postings.setdefault((lang, trigram), []).append(n)
+
+    def get_similar(self, key):
+        """Return the source key most similar to the given one and its
+        similarity, or None if none reaches the threshold."""
+        lang, text = key
+        trigrams = get_trigrams(text)
+        t = self.threshold
+        # A key with Dice similarity >= t shares at least min_shared trigrams,
+        #   so it's in one of the rarest len - min_shared + 1 postings.
+        min_shared = max(1, math.ceil(t * len(trigrams) / (2 - t)))
+        postings = sorted(
+            (self.postings.get((lang, trigram), []) for trigram in trigrams),
+            key=len,
+        )
+        candidates = set()
+        for posting in postings[:len(trigrams) - min_shared + 1]:
+            candidates.update(posting)
+        best = None
+        for n in candidates:
+            key_trigrams = self.key_trigrams[n]
+            similarity = 2 * len(trigrams & key_trigrams) / (len(trigrams) + len(key_trigrams))
+            if similarity >= t and (best is None or similarity > best[1]):
+                best = (self.keys[n], similarity)
+        return best
+
+    def match_sense(self, sense):
+        """Return (cawl, confidence, method, key text) for a sense without a
+        CAWL, or None if it can't be matched with enough confidence.
+
+        Each of the sense's keys found in the source gives one vote, divided
+        among the CAWLs that share it; the confidence is the best CAWL's share
+        of the votes.
+        """
+        keys = get_sense_keys(sense)
+        found = [(key, self.cawls[key]) for key in keys if key in self.cawls]
+        if found:
+            # A CAWL that reaches the threshold has a key with few CAWLs.
+            candidates = {cawl for _, cawls in found if len(cawls) <= self.max_cawls for cawl in cawls}
+            best = None
+            for cawl in candidates:
+                votes = sum(1 / len(cawls) for _, cawls in found if cawl in cawls)
+                if best is None or votes > best[1]:
+                    best = (cawl, votes)
+            if best is None:
+                return None
+            cawl, votes = best
+            confidence = votes / len(found)
+            if confidence < self.threshold:
+                return None
+            key_text = next(key for key, cawls in found if cawl in cawls)[1]
+            return (cawl, confidence, 'exact', key_text)
+        best = None
+        for key in keys:
+            similar = self.get_similar(key)
+            if similar is None:
+                continue
+            source_key, similarity = similar
+            cawls = list(self.cawls[source_key])
+            confidence = similarity / len(cawls)
+            if confidence >= self.threshold and (best is None or confidence > best[1]):
+                best = (cawls[0], confidence, 'similar', source_key[1])
+        return best
@@ -1,5 +1,10 @@
+import time
+
 from os import environ
 from pathlib import Path
+from queue import Empty
+from queue import Queue
+from threading import Event
 from threading import Thread
 from tkinter import filedialog
 from tkinter import IntVar
@@ -9,11 +14,14 @@ from tkinter.ttk import Checkbutton
 from tkinter.ttk import Entry
 from tkinter.ttk import Frame
 from tkinter.ttk import Label
+from tkinter.ttk import Progressbar
 from tkinter.ttk import Separator
 from tkinter.ttk import Style
 
+from . import engine
 from . import util
 
+
 class Gui(Frame):
     # Original window.
     def __init__(self, app, **kwargs):
@@ -113,6 +121,23 @@ class Gui(Frame):
         self.status_lab = Label(self, text="")
         self.status_lab.grid(column=2, row=7, columnspan=2, padx=pad, pady=pady, sticky='W')
 
+        # Row 8: Create Progress Bar.
+        self.progress_bar = Progressbar(self, orient='horizontal', mode='determinate', maximum=100)
+        self.progress_bar.grid(column=0, row=8, columnspan=2, padx=pad, pady=pady, sticky='WE')
+        # Row 8: Create Cancel Button.
+        self.cancel_btn = Button(self, padding=pad, text="Cancel")
+        self.cancel_btn.grid(column=2, row=8, padx=pad, pady=pady, sticky='W')
+        self.cancel_btn.bind("<ButtonRelease>", self.on_cancel_btn_release)
+
+        # Worker thread communication: the worker only puts events in the queue;
+        #   widgets are only changed from the main loop.
+        self.events = Queue()
+        self.cancel_event = Event()
+        self.task_name = None
+        self.stage = None
+        self.stage_start = 0
+        self.last_report = 0
+
         # Set initial state of widgets.
         self.reset_widgets('RESET')
 
@@ -165,60 +190,146 @@ class Gui(Frame):
         if self.o_selected.get() == 1:
             self.app.updates['allow-overwrite'] = True
 
-        # Disable all Widgets.
+        self.update_btn.configure(text="Updating...")
+        if self.app.debug:
+            self.app.print_debug_variables()
+
+        # Start update in own thread.
+        self.start_task('update', self.update_file)
+
+    def on_cancel_btn_release(self, event):
+        if self.cancel_btn['state'] == 'disabled':
+            return
+        self.cancel_event.set()
+        self.status_lab['text'] = "Cancelling..."
+
+    def set_widgets_state(self, state):
         for f in self.winfo_children():
             try:
-                f['state'] = 'disabled'
+                f['state'] = state
             except TclError:
                 pass
             for w in f.winfo_children():
-                w['state'] = 'disabled'
-        self.update_btn.configure(text="Updating...")
-        if self.app.debug:
-            self.app.print_debug_variables()
+                w['state'] = state
+
+    def start_task(self, name, task):
+        # Disable all Widgets except Cancel.
+        self.set_widgets_state('disabled')
+        self.cancel_btn['state'] = 'normal'
+        self.progress_bar['value'] = 0
+        self.cancel_event.clear()
+        self.task_name = name
+        self.stage = None
+        Thread(target=self.run_task, args=(task,), daemon=True).start()
+        self.after(100, self.check_events)
+
+    def run_task(self, task):
+        # Runs in the worker thread.
+        try:
+            self.events.put(('done', task()))
+        except engine.Cancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', e))
+
+    def report_progress(self, stage, done, total):
+        # Runs in the worker thread; raising here stops the task.
+        if self.cancel_event.is_set():
+            raise engine.Cancelled()
+        now = time.monotonic()
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_start = now
+        elif done < total and now - self.last_report < 0.1:
+            return
+        self.last_report = now
+        self.events.put(('progress', (stage, done, total, now - self.stage_start)))
 
-        # Start update in own thread.
-        t_update = Thread(target=self.update_file)
-        t_update.start()
+    def check_events(self):
+        while True:
+            try:
+                kind, value = self.events.get_nowait()
+            except Empty:
+                break
+            if kind == 'progress':
+                self.show_progress(*value)
+            else:
+                self.finish_task(kind, value)
+                return
+        self.after(100, self.check_events)
+
+    def show_progress(self, stage, done, total, elapsed):
+        fraction = done / total if total else 1
+        self.progress_bar['value'] = fraction * 100
+        if stage == 'parse':
+            text = f"Reading file: {fraction:.0%}"
+        elif stage == 'update':
+            text = f"Updating: {done} of {total} CAWL IDs"
+        else:
+            text = f"Writing file: {fraction:.0%}"
+        if 0 < fraction < 1 and elapsed > 1:
+            eta = int(elapsed / fraction * (1 - fraction))
+            text += f", about {eta // 60}:{eta % 60:02d} left"
+        self.status_lab['text'] = text
+
+    def finish_task(self, kind, value):
+        self.cancel_btn['state'] = 'disabled'
+        if self.task_name == 'update':
+            self.reset_widgets('RESET')
+            if kind == 'done' and not value.ok:
+                self.status_lab['text'] = f"Update failed: {value.error}"
+            elif kind == 'done':
+                self.status_lab['text'] = "Update finished"
+        else:
+            self.set_widgets_state('normal')
+            self.cancel_btn['state'] = 'disabled'
+            self.verify_update_btn_state()
+            if kind == 'done':
+                self.status_lab['text'] = value
+        if kind == 'cancelled':
+            self.status_lab['text'] = "Cancelled"
+        elif kind == 'error':
+            self.status_lab['text'] = f"Error: {value}"
+        self.progress_bar['value'] = 0
 
     def get_source_file(self, event):
         selected_file = filedialog.askopenfilename(
             title=self.source_label,
             initialdir=environ.get('SNAP_REAL_HOME', Path.home()),
-            filetypes=[('LIFT', '.lift')],
+            filetypes=[('LIFT', ['.lift', '.lift.gz', '.lift.xz', '.lift.zst'])],
         )
         if selected_file:
             event.widget['text'] = Path(selected_file).name
+            # The file is parsed by the worker thread when it's used.
             self.app.source_file = Path(selected_file)
-            self.app.source_xml = util.get_xml_tree(self.app.source_file)
+            self.app.source_index = None
         self.verify_update_btn_state()
 
     def get_target_file(self, event):
         selected_file = filedialog.askopenfilename(
             title=self.target_label,
-            filetypes=[('LIFT', '.lift')],
+            filetypes=[('LIFT', ['.lift', '.lift.gz', '.lift.xz', '.lift.zst'])],
         )
         if selected_file:
             event.widget['text'] = Path(selected_file).name
             self.app.target_files = [Path(selected_file)]
-            self.app.target_xml = util.get_xml_tree(self.app.target_files[0])
         self.verify_update_btn_state()
 
     def export_pprint_file(self):
-        xml_string = util.xml_tree_to_string(util.get_xml_tree(self.app.source_file))
-        new_file_name = f"{self.app.source_file.stem}_formatted.lift"
-        new_file_obj = self.app.source_file.with_name(new_file_name)
-        if self.app.debug:
-            print(f"Debug: {str(new_file_obj) = }")
-        new_file_obj.write_text(xml_string)
-        self.status_lab['text'] = f"{self.app.source_file} exported as \"{new_file_name}\"."
-        
+        self.start_task('export', self.export_file)
+
+    def export_file(self):
+        # Runs in the worker thread.
+        # Entries are formatted and written one at a time.
+        new_file_obj = util.get_outfile_object(self.app.source_file, '_formatted', self.app.debug, compression='')
+        with util.open_output_file(new_file_obj) as f:
+            util.format_xml_file(self.app.source_file, f, self.report_progress)
+        return f"{self.app.source_file} exported as \"{new_file_obj.name}\"."
 
     def update_file(self):
-        result = self.app.update_file(self.app.target_files[0])
-        if not result:
-            self.status_lab['text'] = f"Update failed for {self.app.target_files[0]}"
-        self.reset_widgets('RESET')
+        # Runs in the worker thread.
+        updater = self.app.get_updater(self.report_progress)
+        return updater.update(self.app.target_files[0], progress=self.report_progress)
 
     def verify_update_btn_state(self):
         if len(self.app.target_files) > 0 and self.app.source_file is not None:
@@ -261,6 +372,8 @@ class Gui(Frame):
         self.update_btn['text'] = "Update LIFT file"
         self.update_btn['state'] = 'disabled'
         self.status_lab['text'] = ''
+        self.cancel_btn['state'] = 'disabled'
+        self.progress_bar['value'] = 0
 
     def reset_variables(self):
         self.app.reset_variables()
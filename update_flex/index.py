@@ -0,0 +1,202 @@
+import copy
+import sys
+
+from . import util
+
+
+class SourceRecord:
+    """The parts of a source sense that updates are copied from."""
+    __slots__ = ('lexical_unit', 'glosses', 'semantic_domains')
+
+    def __init__(self, sense, lexical_unit):
+        # The lexical-unit's (lang, text) is shared by the senses of an entry.
+        self.lexical_unit = lexical_unit
+        # Only the 1st gloss of each language is used.
+        glosses = dict()
+        semantic_domains = []
+        for child in sense.iterchildren('gloss', 'trait'):
+            if child.tag == 'gloss':
+                lang = sys.intern(child.get('lang', ''))
+                if lang not in glosses:
+                    text = child.find('text')
+                    glosses[lang] = text.text if text is not None else None
+            elif child.get('name') == 'semantic-domain-ddp4':
+                value = child.get('value')
+                if value is not None:
+                    semantic_domains.append(sys.intern(value))
+        self.glosses = tuple(glosses.items())
+        self.semantic_domains = tuple(semantic_domains)
+
+    def get_glosses(self, lang):
+        glosses_raw = []
+        if lang == 'sg' and self.lexical_unit is not None: # get lexical-unit text if Source is in Sango
+            lx_lang, text = self.lexical_unit
+            if lx_lang == lang and text is not None:
+                glosses_raw.append(text)
+        for gloss_lang, text in self.glosses:
+            if gloss_lang == lang:
+                if text is not None:
+                    glosses_raw.append(text)
+                break
+        return util.split_terms(glosses_raw)
+
+    def get_semantic_domains(self):
+        return util.split_terms(self.semantic_domains)
+
+
+def get_lexical_unit(entry):
+    lexical_unit = entry.find('lexical-unit')
+    if lexical_unit is None:
+        return None
+    form = lexical_unit.find('form')
+    if form is None:
+        return None
+    text = form.find('text')
+    return (sys.intern(form.get('lang', '')), text.text if text is not None else None)
+
+
+class SourceIndex:
+    """CAWL index of a source file, built once and shared by all target files.
+
+    Only compact records of the values used for updates are kept, so the
+    source entries can be freed as soon as they have been read.
+    """
+    def __init__(self, entries, cawl_type):
+        self.cawl_type = cawl_type
+        self.lx_lang = None
+        self.senses = dict()
+        self.entry_count = 0
+        self.sense_count = 0
+        for entry in entries:
+            self.add_entry(entry)
+        # Normalized values are only gathered the 1st time they're needed.
+        self._glosses = dict()
+        self._semantic_domains = dict()
+
+    @property
+    def cawl_count(self):
+        return len(self.senses)
+
+    def add_entry(self, entry):
+        lexical_unit = get_lexical_unit(entry)
+        if self.entry_count == 0 and lexical_unit is not None:
+            self.lx_lang = lexical_unit[0] or None
+        self.entry_count += 1
+        for sense in entry.iter('sense'):
+            # A sense keeps the 1st CAWL found, as in util.get_cawl_from_sense.
+            cawl = None
+            for field in sense.iter('field'):
+                cawl = util.get_cawl_from_field(field, self.cawl_type)
+                if cawl:
+                    break
+            # Senses without a CAWL can never be matched.
+            if not cawl:
+                continue
+            # Only top-level senses take their entry's lexical-unit.
+            record = SourceRecord(sense, lexical_unit if sense.getparent() is entry else None)
+            self.senses.setdefault(sys.intern(cawl), []).append(record)
+            self.sense_count += 1
+
+    def __contains__(self, cawl):
+        return cawl in self.senses
+
+    def __str__(self):
+        return f"{self.sense_count} senses, {self.cawl_count} CAWLs ({self.cawl_type})"
+
+    def subset(self, cawls):
+        """Return an index limited to the given CAWLs that shares this one's data."""
+        subset = copy.copy(self)
+        subset.senses = {cawl: s for cawl, s in self.senses.items() if cawl in cawls}
+        subset.sense_count = sum(len(senses) for senses in subset.senses.values())
+        return subset
+
+    def get_senses(self, cawl):
+        return self.senses.get(cawl, [])
+
+    def get_glosses(self, cawl, lang):
+        glosses = self._glosses.get((cawl, lang))
+        if glosses is None:
+            glosses = []
+            for record in self.get_senses(cawl):
+                # Combine source file's lexical-unit of same lang and lang's gloss.
+                glosses.extend(record.get_glosses(lang))
+            # Terms are already stripped.
+            glosses = sorted(set(glosses))
+            self._glosses[(cawl, lang)] = glosses
+        return glosses
+
+    def get_semantic_domains(self, cawl):
+        semantic_domains = self._semantic_domains.get(cawl)
+        if semantic_domains is None:
+            semantic_domains = []
+            for record in self.get_senses(cawl):
+                semantic_domains.extend(record.get_semantic_domains())
+            semantic_domains = sorted(set(semantic_domains))
+            self._semantic_domains[cawl] = semantic_domains
+        return semantic_domains
+
+
+def read_source_index(file_obj, cawl_type, progress=None):
+    """Index a source file one entry at a time without keeping its tree."""
+    return SourceIndex(util.iter_xml_entries(file_obj, progress), cawl_type)
+
+def read_source_index_types(file_obj, cawl_types, progress=None):
+    """Index a source file for each of the given CAWL types in a single pass,
+    and return the indexes by CAWL type."""
+    source_indexes = {cawl_type: SourceIndex((), cawl_type) for cawl_type in cawl_types}
+    for entry in util.iter_xml_entries(file_obj, progress):
+        for source_index in source_indexes.values():
+            source_index.add_entry(entry)
+    return source_indexes
+
+def read_source_indexes(file_objs, cawl_type, progress=None):
+    """Index source files given in order of precedence, merging them if
+    there's more than one."""
+    source_indexes = [read_source_index(f, cawl_type, progress) for f in file_objs]
+    if len(source_indexes) > 1:
+        return MergedIndex(source_indexes)
+    return source_indexes[0]
+
+
+class MergedIndex:
+    """CAWL index of several source files in order of precedence. Each field
+    of a CAWL is taken from the 1st source that has values for it."""
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.cawl_type = indexes[0].cawl_type
+        self.lx_lang = indexes[0].lx_lang
+        self.senses = dict()
+        for source_index in indexes:
+            for cawl, senses in source_index.senses.items():
+                self.senses.setdefault(cawl, []).extend(senses)
+        self.cawl_count = len(self.senses)
+        self.sense_count = sum(len(senses) for senses in self.senses.values())
+
+    def __contains__(self, cawl):
+        return cawl in self.senses
+
+    def __str__(self):
+        return f"{self.sense_count} senses, {self.cawl_count} CAWLs ({self.cawl_type}) from {len(self.indexes)} sources"
+
+    def subset(self, cawls):
+        """Return an index limited to the given CAWLs that shares this one's data."""
+        return MergedIndex([source_index.subset(cawls) for source_index in self.indexes])
+
+    def get_senses(self, cawl):
+        return self.senses.get(cawl, [])
+
+    def get_glosses(self, cawl, lang):
+        for source_index in self.indexes:
+            if cawl in source_index:
+                glosses = source_index.get_glosses(cawl, lang)
+                if glosses:
+                    return glosses
+        return []
+
+    def get_semantic_domains(self, cawl):
+        for source_index in self.indexes:
+            if cawl in source_index:
+                semantic_domains = source_index.get_semantic_domains(cawl)
+                if semantic_domains:
+                    return semantic_domains
+        return []
@@ -0,0 +1,69 @@
+import hashlib
+import json
+
+from pathlib import Path
+
+
+def get_settings(source_index, updates):
+    # Hashes can only be compared between runs that use the same settings.
+    return {
+        'cawl-type': source_index.cawl_type,
+        'glosses': updates.get('glosses', []),
+        'semantic-domain': bool(updates.get('semantic-domain', False)),
+        'allow-overwrite': bool(updates.get('allow-overwrite', False)),
+    }
+
+def get_target_state(target_file):
+    # A target that's been replaced or edited since the last run can't be
+    #   assumed to have that run's updates.
+    stat = Path(target_file).stat()
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def get_cawl_hash(source_index, cawl, updates):
+    # Hash of the normalized values that an update would copy for this CAWL.
+    values = [source_index.get_glosses(cawl, lang) for lang in updates.get('glosses', [])]
+    if updates.get('semantic-domain', False):
+        values.append(source_index.get_semantic_domains(cawl))
+    data = json.dumps(values, ensure_ascii=False).encode('UTF-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def get_hashes(source_index, updates):
+    return {cawl: get_cawl_hash(source_index, cawl, updates) for cawl in source_index.senses}
+
+def load_manifest(manifest_file):
+    manifest_file = Path(manifest_file)
+    if not manifest_file.is_file():
+        return None
+    with manifest_file.open(encoding='UTF-8') as f:
+        return json.load(f)
+
+def get_targets(manifest, source_index, updates):
+    # Records of the targets updated with the same settings, by path.
+    if manifest is None:
+        return dict()
+    old_settings = {k: v for k, v in manifest.items() if k != 'targets'}
+    if old_settings != get_settings(source_index, updates):
+        # Different options were used: everything needs to be updated.
+        return dict()
+    return manifest.get('targets', dict())
+
+def save_manifest(manifest_file, source_index, updates, hashes, target_files):
+    """Record the hashes that the target files have been updated with,
+    keeping the records of other targets made with the same settings."""
+    targets = get_targets(load_manifest(manifest_file), source_index, updates)
+    for target_file in target_files:
+        targets[str(Path(target_file).resolve())] = dict(get_target_state(target_file), hashes=hashes)
+    manifest = get_settings(source_index, updates)
+    manifest['targets'] = targets
+    with open(manifest_file, 'w', encoding='UTF-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+
+def get_changed_cawls(manifest, source_index, updates, hashes, target_file):
+    """Return the CAWLs whose source values differ from those that the target
+    file was last updated with, or all of them if it's not in the manifest or
+    has changed since then."""
+    target = get_targets(manifest, source_index, updates).get(str(Path(target_file).resolve()))
+    if target is None or {k: target.get(k) for k in ('size', 'mtime')} != get_target_state(target_file):
+        return set(hashes)
+    old_hashes = target['hashes']
+    return {cawl for cawl, h in hashes.items() if old_hashes.get(cawl) != h}
@@ -0,0 +1,141 @@
+import time
+
+from collections import Counter
+from collections import deque
+from lxml import etree
+from pathlib import Path
+from sys import exit
+
+from . import util
+
+# Entries sent to a worker process at a time.
+CHUNK_SIZE = 500
+
+
+def is_normalized(values):
+    # Whether dedupe_glosses or dedupe_semantic_domains would leave these as they are.
+    return len(values) == 1 and util.normalize_text(values[0]) == values[0]
+
+def normalize_sense(sense, stats):
+    """Merge the sense's glosses in each language and its semantic domains,
+    and mark it as modified if anything changed."""
+    gloss_texts = dict()
+    sd_values = []
+    for child in sense.iterchildren('gloss', 'trait'):
+        if child.tag == 'gloss':
+            gloss_texts.setdefault(child.get('lang'), []).append(child.findtext('text'))
+        elif child.get('name') == 'semantic-domain-ddp4':
+            sd_values.append(child.get('value'))
+    changed = False
+    for lang, texts in gloss_texts.items():
+        # Glosses without text can't be merged.
+        if None in texts or is_normalized(texts):
+            continue
+        # Only the number of elements removed is reported.
+        stats['glosses-removed'] += util.dedupe_glosses(lang, sense, verbose=False)
+        changed = True
+    if sd_values and None not in sd_values and not is_normalized(sd_values):
+        stats['semantic-domains-removed'] += util.dedupe_semantic_domains(sense, verbose=False)
+        changed = True
+    if changed:
+        util.update_timestamps(sense)
+        stats['senses-normalized'] += 1
+
+def normalize_entry(entry, stats):
+    for sense in entry.iter('sense'):
+        normalize_sense(sense, stats)
+
+def normalize_chunk(root_data, chunk):
+    """Normalize a chunk of serialized top-level elements in a worker process
+    and return them pretty-printed, with the chunk's stats."""
+    stats = Counter()
+    wrapper, start, end = util.get_xml_wrapper(etree.fromstring(root_data))
+    parts = []
+    for data in chunk:
+        elem = util.bytes_to_xml_child(data)
+        if elem.tag == 'entry':
+            normalize_entry(elem, stats)
+        parts.append(util.format_xml_child(wrapper, start, end, elem))
+    return b''.join(parts), stats
+
+def normalize_file(infile_obj, outfile_obj, jobs=1, chunk_size=CHUNK_SIZE, progress=None):
+    """Write a LIFT file with the glosses and semantic domains of all of its
+    senses deduplicated, pretty-printed as the whole tree would be. With
+    jobs > 1, entries are normalized in chunks by worker processes and
+    written in their original order. Return the stats. Nothing is left at
+    outfile_obj if it fails."""
+    stats = Counter({'senses-normalized': 0, 'glosses-removed': 0, 'semantic-domains-removed': 0})
+    executor = None
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    # Chunks being normalized, in order; a few per worker are kept queued
+    #   so that workers stay busy without holding the whole file in memory.
+    pending = deque()
+    chunk = []
+
+    def write_chunk(out, future):
+        data, chunk_stats = future.result()
+        out.write(data)
+        stats.update(chunk_stats)
+
+    try:
+        with util.open_output_file(outfile_obj) as out:
+            out.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+            wrapper = None
+            for kind, elem in util.iter_xml_file(infile_obj, progress):
+                if kind in ('comment', 'pi'):
+                    out.write(etree.tostring(elem) + b'\n')
+                elif kind == 'root':
+                    wrapper, start, end = util.get_xml_wrapper(elem)
+                    root_data = etree.tostring(wrapper)
+                    out.write(start)
+                elif executor is None:
+                    if elem.tag == 'entry':
+                        normalize_entry(elem, stats)
+                    out.write(util.format_xml_child(wrapper, start, end, elem))
+                else:
+                    chunk.append(etree.tostring(elem))
+                    if len(chunk) >= chunk_size:
+                        pending.append(executor.submit(normalize_chunk, root_data, chunk))
+                        chunk = []
+                        while len(pending) > 2 * jobs:
+                            write_chunk(out, pending.popleft())
+            if chunk:
+                pending.append(executor.submit(normalize_chunk, root_data, chunk))
+            while pending:
+                write_chunk(out, pending.popleft())
+            if wrapper is not None:
+                out.write(end)
+    finally:
+        if executor is not None:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+    return stats
+
+def main(args):
+    compression = args.compress
+    if compression is not None:
+        compression = '' if compression == 'none' else f".{compression}"
+    failed = False
+    for target in args.target_db:
+        target_file = Path(target).resolve()
+        outfile = util.get_outfile_object(target_file, '_normalized', False, compression=compression)
+        start = time.perf_counter()
+        try:
+            stats = normalize_file(target_file, outfile, args.jobs)
+        except (OSError, etree.XMLSyntaxError) as e:
+            print(f"Error: {e}")
+            failed = True
+            continue
+        print(f"Updated file saved as \"{outfile}\"")
+        print(
+            f"{target_file.name}: {stats['senses-normalized']} senses normalized, "
+            f"{stats['glosses-removed']} glosses removed, "
+            f"{stats['semantic-domains-removed']} semantic domains removed "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+    if failed:
+        exit(1)
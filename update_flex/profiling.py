@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def get_rss():
+    # Current resident set size in bytes.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        # Not Linux: fall back to the peak value, which is all that's available.
+        try:
+            import resource
+        except ImportError: # Windows
+            return 0
+        factor = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * factor
+
+
+class PeakMemory:
+    """Sample RSS in a background thread while the context is active."""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = get_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, get_rss())
+
+
+class Profiler:
+    """Record wall time and peak RSS of each phase, and update counters, per file.
+
+    Phases that aren't tied to a target file (e.g. loading the source) are
+    recorded under 'run'.
+    """
+    def __init__(self):
+        self.files = dict()
+
+    def get_file_record(self, file):
+        key = 'run' if file is None else str(file)
+        if key not in self.files:
+            self.files[key] = {'phases': dict(), 'counters': dict()}
+        return self.files[key]
+
+    @contextmanager
+    def phase(self, name, file=None):
+        with PeakMemory() as mem:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - start
+        self.get_file_record(file)['phases'][name] = {
+            'seconds': round(elapsed, 4),
+            'peak_rss_mb': round(mem.peak / 2**20, 1),
+        }
+
+    def add_counters(self, file, stats):
+        counters = self.get_file_record(file)['counters']
+        for key, value in stats.items():
+            if key != 'time':
+                counters[key] = counters.get(key, 0) + value
+
+    def merge(self, other):
+        # Combine records from a profiler used in a worker process.
+        for key, record in other.files.items():
+            self.files.setdefault(key, {'phases': dict(), 'counters': dict()})
+            self.files[key]['phases'].update(record['phases'])
+            self.files[key]['counters'].update(record['counters'])
+
+    def to_dict(self):
+        return {'files': self.files}
+
+    def save(self, outfile):
+        Path(outfile).write_text(json.dumps(self.to_dict(), indent=2))
@@ -0,0 +1,74 @@
+import sys
+import time
+
+
+class ProgressBar:
+    """Progress callback that draws a throttled bar with an ETA on stderr.
+
+    It's called as progress(stage, done, total) with stage 'parse' (bytes
+    read), 'update' (CAWLs processed) or 'write' (bytes written). A stage's
+    line is ended when the stage is done or another one starts.
+    """
+    LABELS = {'parse': "Reading", 'update': "Updating", 'write': "Writing"}
+
+    def __init__(self, name='', interval=0.1, width=30, stream=None):
+        self.name = name
+        self.interval = interval
+        self.width = width
+        self.stream = stream if stream is not None else sys.stderr
+        self.stage = None
+        self.stage_start = 0
+        self.last_draw = 0
+        self.line_open = False
+        self.stage_done = False
+        self.last_done = 0
+
+    def __call__(self, stage, done, total):
+        now = time.monotonic()
+        # A count that goes back starts over, e.g. for the next source file.
+        if stage != self.stage or done < self.last_done:
+            self.finish()
+            self.stage = stage
+            self.stage_start = now
+            self.stage_done = False
+        elif self.stage_done:
+            return
+        elif not (total and done >= total) and now - self.last_draw < self.interval:
+            # Only a stage's last call is always drawn, whether or not its
+            #   total is known.
+            return
+        self.last_done = done
+        self.last_draw = now
+        self.draw(stage, done, total, now - self.stage_start)
+        if total and done >= total:
+            self.stage_done = True
+            self.finish()
+
+    def draw(self, stage, done, total, elapsed):
+        label = self.LABELS.get(stage, stage.capitalize())
+        if stage == 'update':
+            amount = f"{done}/{total} CAWLs"
+        elif total:
+            amount = f"{done / 2**20:.1f}/{total / 2**20:.1f} MB"
+        else:
+            amount = f"{done / 2**20:.1f} MB"
+        text = f"{self.name} {label}" if self.name else label
+        if total:
+            fraction = min(done / total, 1)
+            filled = int(fraction * self.width)
+            text += f" [{'#' * filled}{' ' * (self.width - filled)}] {fraction:4.0%} {amount}"
+            if 0 < fraction < 1 and elapsed > 1:
+                eta = int(elapsed / fraction * (1 - fraction))
+                text += f", about {eta // 60}:{eta % 60:02d} left"
+        else:
+            text += f" {amount}"
+        # Pad to clear what's left of a longer previous line.
+        self.stream.write(f"\r{text:<79}")
+        self.stream.flush()
+        self.line_open = True
+
+    def finish(self):
+        if self.line_open:
+            self.stream.write('\n')
+            self.stream.flush()
+            self.line_open = False
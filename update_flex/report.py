@@ -0,0 +1,156 @@
+import csv
+import json
+import sys
+
+from collections import Counter
+from pathlib import Path
+
+from . import index
+from . import util
+
+# Counts kept for each field (a gloss language or the semantic domain).
+FIELD_KEYS = ['present', 'missing', 'missing-with-source', 'duplicate-elements', 'duplicate-terms']
+CSV_FIELDS = ['file', 'senses', 'senses-with-cawl', 'cawl-matches', 'cawls', 'cawls-matched', 'field', 'lang'] + FIELD_KEYS
+
+
+def report_sense(sense, cawl, source_index, langs, report):
+    matched = cawl is not None and cawl in source_index
+    gloss_texts = dict()
+    sd_values = []
+    for child in sense.iterchildren('gloss', 'trait'):
+        if child.tag == 'gloss':
+            gloss_texts.setdefault(child.get('lang'), []).append(child.findtext('text'))
+        elif child.get('name') == 'semantic-domain-ddp4':
+            sd_values.append(child.get('value'))
+    fields = [(('gloss', lang), gloss_texts.get(lang, [])) for lang in langs]
+    fields.append((('semantic-domain', ''), sd_values))
+    for (field, lang), values in fields:
+        counts = report['fields'].setdefault((field, lang), Counter())
+        if not values:
+            counts['missing'] += 1
+            if matched:
+                if field == 'gloss':
+                    has_source = len(source_index.get_glosses(cawl, lang)) > 0
+                else:
+                    has_source = len(source_index.get_semantic_domains(cawl)) > 0
+                if has_source:
+                    counts['missing-with-source'] += 1
+        else:
+            counts['present'] += 1
+            # Extra elements that dedupe_glosses or dedupe_semantic_domains
+            #   would remove, and repeated terms, in one element or across
+            #   several, that they would merge.
+            counts['duplicate-elements'] += len(values) - 1
+            values = [v for v in values if v is not None]
+            if values:
+                counts['duplicate-terms'] += sum(v.count(';') + 1 for v in values) - len(util.split_terms(values))
+
+def report_file(target_file, source_index, cawl_type, langs):
+    """Gather CAWL coverage and per-field counts for a target file in one
+    streaming pass."""
+    report = {'senses': 0, 'senses-with-cawl': 0, 'cawl-matches': 0, 'fields': dict()}
+    cawls = set()
+    for entry in util.iter_xml_entries(target_file):
+        for cawl, senses in util.get_cawl_dict(entry, cawl_type).items():
+            report['senses'] += len(senses)
+            if cawl is not None:
+                cawls.add(cawl)
+                report['senses-with-cawl'] += len(senses)
+                if cawl in source_index:
+                    report['cawl-matches'] += len(senses)
+            for sense in senses:
+                report_sense(sense, cawl, source_index, langs, report)
+    report['cawls'] = len(cawls)
+    report['cawls-matched'] = sum(1 for cawl in cawls if cawl in source_index)
+    return report
+
+def get_source_langs(source_index):
+    # Languages that the source has glosses for, including a Sango lexical-unit.
+    langs = set()
+    for records in source_index.senses.values():
+        for record in records:
+            langs.update(lang for lang, text in record.glosses)
+            if record.lexical_unit is not None and record.lexical_unit[0] == 'sg':
+                langs.add('sg')
+    langs.discard('')
+    return sorted(langs)
+
+def get_total(reports):
+    total = {'senses': 0, 'senses-with-cawl': 0, 'cawl-matches': 0, 'cawls': 0, 'cawls-matched': 0, 'fields': dict()}
+    for report in reports:
+        for key, value in report.items():
+            if key == 'fields':
+                for field, counts in value.items():
+                    total['fields'].setdefault(field, Counter()).update(counts)
+            else:
+                total[key] += value
+    return total
+
+def get_rows(name, report):
+    for (field, lang), counts in sorted(report['fields'].items()):
+        row = {k: v for k, v in report.items() if k != 'fields'}
+        row.update({'file': name, 'field': field, 'lang': lang})
+        row.update({k: counts[k] for k in FIELD_KEYS})
+        yield row
+
+def to_json(report):
+    # Fields are nested by name, then by language for glosses.
+    data = {k: v for k, v in report.items() if k != 'fields'}
+    for (field, lang), counts in sorted(report['fields'].items()):
+        counts = {k: counts[k] for k in FIELD_KEYS}
+        if field == 'gloss':
+            data.setdefault('glosses', dict())[lang] = counts
+        else:
+            data[field] = counts
+    return data
+
+def write_report(reports, source_index, outfile, output_format):
+    total = get_total(reports.values())
+    if output_format == 'json':
+        data = {
+            'source': str(source_index),
+            'files': {name: to_json(report) for name, report in reports.items()},
+            'total': to_json(total),
+        }
+        json.dump(data, outfile, ensure_ascii=False, indent=2)
+        outfile.write('\n')
+    else:
+        writer = csv.DictWriter(outfile, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for name, report in reports.items():
+            writer.writerows(get_rows(name, report))
+        if len(reports) > 1:
+            writer.writerows(get_rows('total', total))
+
+def main(args):
+    source_files = [Path(f).resolve() for f in [args.source_db] + (args.extra_source or [])]
+    target_files = [Path(f).resolve() for f in args.target_db]
+    source_index = index.read_source_indexes(source_files, args.source_id_type or 'CAWL')
+    target_cawl_type = args.target_id_type or 'CAWL'
+    if args.glosses:
+        langs = util.parse_glosses_string_to_list(args.glosses)
+    else:
+        langs = get_source_langs(source_index)
+
+    if args.jobs > 1 and len(target_files) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [
+                executor.submit(report_file, f, source_index, target_cawl_type, langs)
+                for f in target_files
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [report_file(f, source_index, target_cawl_type, langs) for f in target_files]
+    reports = {f.name: report for f, report in zip(target_files, results)}
+
+    output_format = args.format
+    if output_format is None:
+        output_format = 'csv' if args.output and Path(args.output).suffix == '.csv' else 'json'
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8', newline='') as f:
+            write_report(reports, source_index, f, output_format)
+        print(f"Report saved as \"{args.output}\"")
+    else:
+        write_report(reports, source_index, sys.stdout, output_format)
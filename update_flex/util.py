@@ -1,13 +1,29 @@
 import argparse
+import contextlib
 import datetime
-import importlib.metadata
+import functools
+import gzip
+import io
+import lzma
+import mmap
 import re
+import sys
 
+from collections import Counter
 from lxml import etree
 from pathlib import Path
 
 
+ENTRY_TAG_RE = re.compile(rb'<entry[\s/>]|</entry\s*>')
+# Number of distinct raw gloss or semantic domain strings whose terms are memoized.
+TERM_CACHE_SIZE = 2**17
+COMPRESSION_SUFFIXES = ['.gz', '.xz', '.zst']
+
+
 def get_version_string():
+    # Only imported when needed because it's slow to import.
+    import importlib.metadata
+
     version_string = 'unknown'
     try:
         version_string = importlib.metadata.version('update-flex')
@@ -23,18 +39,108 @@ def get_version_string():
                 break
     return version_string
 
-def get_outfile_object(old_file_obj, tag, debug):
-    new_file_name = f"{old_file_obj.stem}{tag}.lift"
+def get_compression_suffix(file_obj):
+    suffix = Path(file_obj).suffix
+    return suffix if suffix in COMPRESSION_SUFFIXES else ''
+
+@contextlib.contextmanager
+def open_lift_file(file_obj, mode='rb', progress=None):
+    """Open a LIFT file for binary reading or writing, (de)compressing it as a
+    stream according to its suffix. When reading, progress is reported in
+    bytes of the file as stored."""
+    compression = get_compression_suffix(file_obj)
+    if compression == '.zst':
+        # Optional dependency.
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"The zstandard package is needed for \"{file_obj}\"; install it with: pip install zstandard")
+    with open(file_obj, mode) as raw:
+        f = raw
+        if progress is not None:
+            f = ProgressReader(raw, Path(file_obj).stat().st_size, progress)
+        if compression == '.gz':
+            with gzip.GzipFile(fileobj=f, mode=mode) as z:
+                yield z
+        elif compression == '.xz':
+            with lzma.LZMAFile(f, mode=mode) as z:
+                yield z
+        elif compression == '.zst':
+            with zstandard.open(f, mode, closefd=False) as z:
+                yield z
+        else:
+            yield f
+
+@contextlib.contextmanager
+def temporary_outfile(file_obj):
+    """Yield the path of a temporary file in the same directory as file_obj,
+    which replaces file_obj once the block completes, unless the block has
+    removed it; if it fails, the temporary file is removed, so a partly
+    written file is never left."""
+    file_obj = Path(file_obj)
+    # The compression suffix is kept, and the name isn't that of a LIFT file.
+    part_file = file_obj.with_name(f".{file_obj.stem}.part{file_obj.suffix}")
+    try:
+        yield part_file
+    except BaseException:
+        if part_file.exists():
+            part_file.unlink()
+        raise
+    if part_file.exists():
+        part_file.replace(file_obj)
+
+@contextlib.contextmanager
+def open_output_file(file_obj, mode='wb'):
+    """Open a LIFT file for writing as open_lift_file does, through a
+    temporary_outfile."""
+    with temporary_outfile(file_obj) as part_file:
+        with open_lift_file(part_file, mode) as f:
+            yield f
+
+def get_outfile_object(old_file_obj, tag, debug, suffix='.lift', compression=None):
+    # The output is compressed like the input unless a compression is given;
+    #   other outputs (e.g. '.json') are never compressed.
+    stem = old_file_obj.stem
+    old_compression = get_compression_suffix(old_file_obj)
+    if old_compression:
+        stem = Path(stem).stem
+    if suffix == '.lift':
+        suffix += old_compression if compression is None else compression
+    new_file_name = f"{stem}{tag}{suffix}"
     new_file_obj = old_file_obj.with_name(new_file_name)
     if debug:
         print(f"Debug: {str(new_file_obj) = }")
     return new_file_obj
 
+def get_outfile_tag(updates):
+    tag = '_updated'
+    if updates.get('semantic-domain'):
+        tag += '-s'
+    langs = updates.get('glosses')
+    if langs is not None:
+        tag += '-' + '-'.join(langs)
+    return tag
+
 def get_cawl_dict(xml_tree, cawl_type):
+    # Walk the document once, giving each CAWL field to the sense(s) that
+    #   contain it, rather than searching the subtree of every sense. A sense
+    #   keeps the 1st CAWL found, as in get_cawl_from_sense.
+    senses = []
+    sense_cawls = dict()
+    for elem in xml_tree.iter('sense', 'field'):
+        if elem.tag == 'sense':
+            senses.append(elem)
+            continue
+        cawl = get_cawl_from_field(elem, cawl_type)
+        if not cawl:
+            continue
+        for sense in elem.iterancestors('sense'):
+            if sense not in sense_cawls:
+                sense_cawls[sense] = cawl
+
     cawls = dict()
-    senses = xml_tree.findall('.//sense')
     for sense in senses:
-        cawl = get_cawl_from_sense(sense, cawl_type)
+        cawl = sense_cawls.get(sense)
         if cawls.get(cawl) is None:
             cawls[cawl] = [sense]
         else:
@@ -55,79 +161,240 @@ def update_timestamps(sense):
     entry = sense.getparent()
     entry.attrib['dateModified'] = timestamp
 
-def get_xml_tree(file_object):
+class ProgressReader:
+    """File wrapper that reports how many bytes have been read."""
+    def __init__(self, f, total, progress):
+        self.f = f
+        self.total = total
+        self.done = 0
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.done += len(data)
+        self.progress('parse', self.done, self.total)
+        return data
+
+class ProgressWriter:
+    """File wrapper that reports how many bytes have been written. The total
+    is only an estimate, so it's raised if more bytes are written."""
+    def __init__(self, f, total, progress):
+        self.f = f
+        self.total = total
+        self.done = 0
+        self.progress = progress
+
+    def write(self, data):
+        n = self.f.write(data)
+        self.done += len(data)
+        # The total is only reached by the last call, once writing is done.
+        total = max(self.total, self.done + 1) if self.total else 0
+        self.progress('write', self.done, total)
+        return n
+
+def get_size_hint(file_obj):
+    # Expected size of a file's uncompressed data, or 0 if unknown.
+    if get_compression_suffix(file_obj):
+        return 0
+    return Path(file_obj).stat().st_size
+
+def get_xml_tree(file_object, progress=None):
     # Remove existing line breaks to allow pretty_print to work properly later.
     parser = etree.XMLParser(remove_blank_text=True)
-    return etree.parse(str(file_object), parser)
+    with open_xml_source(file_object, progress) as source:
+        return etree.parse(source, parser)
 
-def print_xml_tree(xml_tree):
-    print(
-        etree.tostring(
-            xml_tree, encoding='UTF-8', pretty_print=True, xml_declaration=True
-        ).decode().rstrip()
-    )
+@contextlib.contextmanager
+def open_xml_source(file_obj, progress=None):
+    # Uncompressed LIFT data can also be given as bytes or a binary file object.
+    if isinstance(file_obj, (bytes, bytearray)):
+        yield io.BytesIO(file_obj)
+    elif hasattr(file_obj, 'read'):
+        yield file_obj
+    # lxml reads plain files fastest by path.
+    elif progress is None and not get_compression_suffix(file_obj):
+        yield str(file_obj)
+    else:
+        with open_lift_file(file_obj, progress=progress) as f:
+            yield f
 
-def xml_tree_to_string(xml_tree):
-    xml_string = etree.tostring(
-        xml_tree, encoding='UTF-8', pretty_print=True, xml_declaration=True
-    ).decode().rstrip()
-    return xml_string
-
-def get_lx_lang(xml_entry):
-    lang = None
-    lexical_unit = xml_entry.find('lexical-unit')
-    if len(lexical_unit) > 0:
-        form = lexical_unit.find('form')
-        if len(form) > 0:
-            lang = form.get('lang')
-    return lang
-
-def get_glosses_from_sense(lang, sense):
-    glosses_raw = []
-    if lang == 'sg': # get lexical-unit text if Source is in Sango
-        gloss = get_lang_lexical_unit_from_sense(sense, lang)
-        if gloss is not None:
-            glosses_raw.append(gloss)
-    gloss = get_lang_gloss_from_sense(sense, lang)
-    if gloss is not None:
-        glosses_raw.append(gloss)
-    glosses_raw = normalize_list(glosses_raw)
-
-    # Consolidate repeated terms in glosses.
-    glosses = []
-    for g_raw in glosses_raw:
-        gs = g_raw.split(';')
-        gs = list(set([g.strip() for g in gs]))
-        glosses.extend(gs)
-    glosses = normalize_list(glosses)
+def iter_xml_file(infile_obj, progress=None):
+    """Parse a LIFT file incrementally.
 
-    return glosses
+    Yields ('comment', elem) and ('pi', elem) for comments and processing
+    instructions before the root element, ('root', elem) when the root element
+    starts, then ('child', elem) for each fully-parsed child of the root,
+    including its comments and processing instructions. Children are cleared
+    once the caller is done with them.
+    """
+    with open_xml_source(infile_obj, progress) as source:
+        # Remove existing line breaks to allow pretty_print to work properly later.
+        context = etree.iterparse(
+            source, events=('start', 'end', 'comment', 'pi'), remove_blank_text=True
+        )
+        root = None
+        for event, elem in context:
+            if root is None:
+                if event == 'start':
+                    root = elem
+                    yield 'root', elem
+                elif event in ('comment', 'pi'):
+                    yield event, elem
+                continue
+            # Only handle fully-parsed children of the root element; comments
+            #   and processing instructions are complete when they're seen.
+            if event == 'start' or elem.getparent() is not root:
+                continue
+            yield 'child', elem
+            # Free memory used by elements that have already been handled.
+            elem.clear()
+            while elem.getprevious() is not None:
+                del root[0]
 
-def get_lang_lexical_unit_from_sense(sense, lang):
-    text = None
-    entry = sense.getparent()
-    lexical_unit = entry.find('lexical-unit')
-    if lexical_unit is not None:
-        form = lexical_unit.find('form')
-        if form.get('lang') == lang:
-            text = form.find('text').text
-    return text
-
-def get_lang_gloss_from_sense(sense, lang):
-    text = None
-    glosses = sense.findall('gloss')
-    if glosses is None:
-        glosses = []
-    for g in glosses:
-        if g.get('lang') == lang:
-            text = g.find('text').text # returns first matching gloss
-            break
-    return text
+def iter_xml_entries(infile_obj, progress=None):
+    """Yield each 'entry' element of a LIFT file, clearing it once the caller
+    is done with it."""
+    with open_xml_source(infile_obj, progress) as source:
+        # Only entry end events reach Python, which is much faster than
+        #   handling the events of every element.
+        for event, elem in etree.iterparse(source, events=('end',), tag='entry', remove_blank_text=True):
+            yield elem
+            # Free memory used by entries that have already been handled.
+            elem.clear()
+            parent = elem.getparent()
+            while elem.getprevious() is not None:
+                del parent[0]
+
+def stream_xml_file(infile_obj, outfile_obj, entry_callback=None, progress=None):
+    """Copy a LIFT file one top-level element at a time, passing each 'entry'
+    element to entry_callback before it is written and cleared. Progress is
+    reported in bytes read, as for parsing. Nothing is left at outfile_obj
+    if it fails."""
+    with open_output_file(outfile_obj) as f:
+        format_xml_file(infile_obj, f, progress, entry_callback)
+
+def save_xml_tree(xml_tree, outfile_obj, progress=None, size_hint=0):
+    """Write a LIFT tree. If given, progress is called as
+    progress('write', bytes_written, bytes_expected), where the expected size
+    is size_hint until it's exceeded; the last call has both equal. Nothing is
+    left at outfile_obj if it fails."""
+    if progress is None and not get_compression_suffix(outfile_obj):
+        with temporary_outfile(outfile_obj) as part_file:
+            xml_tree.write(
+                str(part_file), encoding='UTF-8', pretty_print=True, xml_declaration=True
+            )
+        return
+    # lxml serializes into the (compressed) stream in small chunks, so the
+    #   whole document is never held in memory.
+    with open_output_file(outfile_obj) as f:
+        if progress is not None:
+            f = ProgressWriter(f, size_hint, progress)
+        xml_tree.write(f, encoding='UTF-8', pretty_print=True, xml_declaration=True)
+    if progress is not None:
+        progress('write', f.done, f.done)
+
+def bytes_to_xml_child(data, parser=None):
+    # Parse a serialized child of the root element, which may also be a
+    #   comment or processing instruction.
+    return etree.fromstring(b'<root>' + data + b'</root>', parser)[0]
+
+def xml_entry_to_bytes(entry):
+    return etree.tostring(entry, encoding='UTF-8', pretty_print=True, with_tail=False).rstrip(b'\n')
+
+def get_entry_spans(data):
+    # Byte ranges of the <entry> elements in a LIFT file's raw data.
+    spans = []
+    start = None
+    for m in ENTRY_TAG_RE.finditer(data):
+        if m.group().startswith(b'</'):
+            if start is not None:
+                spans.append((start, m.end()))
+            start = None
+        else:
+            start = m.start()
+            tag_end = data.find(b'>', start) + 1
+            if data[tag_end - 2:tag_end] == b'/>':
+                # Empty entry.
+                spans.append((start, tag_end))
+                start = None
+    return spans
+
+def patch_xml_file(infile_obj, outfile_obj, replacements, entry_count):
+    """Copy a LIFT file byte for byte except for the entries whose position is
+    a key of replacements, which are replaced by the serialized entry.
+
+    Nothing is written and False is returned if the file's entries can't be
+    located reliably.
+    """
+    if get_compression_suffix(infile_obj) or get_compression_suffix(outfile_obj):
+        # Compressed files can't be mapped into memory.
+        return False
+    with open(infile_obj, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if not data[:200].lstrip().startswith(b'<?xml') or b'UTF-8' not in data[:200].upper():
+                # Only UTF-8 LIFT files can be patched safely.
+                return False
+            spans = get_entry_spans(data)
+            if len(spans) != entry_count:
+                return False
+            with temporary_outfile(outfile_obj) as part_file, open(part_file, 'wb') as out:
+                pos = 0
+                for i in sorted(replacements):
+                    start, end = spans[i]
+                    out.write(data[pos:start])
+                    out.write(replacements[i])
+                    pos = end
+                out.write(data[pos:])
+    return True
+
+def get_xml_wrapper(root):
+    """Return an empty copy of the root element and the bytes printed before
+    and after its children when it's pretty-printed."""
+    # Each child is printed inside the copy so that it's indented as it
+    #   would be in the whole tree.
+    wrapper = etree.Element(root.tag, root.attrib, nsmap=root.nsmap)
+    marker = etree.SubElement(wrapper, 'marker')
+    start, end = etree.tostring(wrapper, encoding='UTF-8', pretty_print=True).split(b'  <marker/>\n')
+    wrapper.remove(marker)
+    return wrapper, start, end
+
+def format_xml_child(wrapper, start, end, elem):
+    # Pretty-print a child of the root element as it is in the whole tree.
+    wrapper.append(elem)
+    data = etree.tostring(wrapper, encoding='UTF-8', pretty_print=True)[len(start):-len(end)]
+    wrapper.remove(elem)
+    return data
+
+def format_xml_file(infile_obj, outfile, progress=None, entry_callback=None):
+    """Write a LIFT file pretty-printed to the binary file object outfile, one
+    top-level element at a time, exactly as the whole tree would be printed.
+    If given, entry_callback is called with each 'entry' element before it's
+    written."""
+    outfile.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+    wrapper = None
+    for kind, elem in iter_xml_file(infile_obj, progress):
+        if kind in ('comment', 'pi'):
+            outfile.write(etree.tostring(elem) + b'\n')
+        elif kind == 'root':
+            wrapper, start, end = get_xml_wrapper(elem)
+            written = False
+        else:
+            if not written:
+                outfile.write(start)
+                written = True
+            if elem.tag == 'entry' and entry_callback is not None:
+                entry_callback(elem)
+            outfile.write(format_xml_child(wrapper, start, end, elem))
+    if wrapper is not None:
+        outfile.write(end if written else etree.tostring(wrapper, encoding='UTF-8', pretty_print=True))
 
 def get_cawl_from_field(field, cawl_type):
     cawl = None
     if field.get('type') == cawl_type:
-        cawl = field.find('form').find('text').text.strip()
+        # Faster than field.find('form').find('text').
+        text = next(field.iter('text'), None)
+        if text is not None and text.text is not None:
+            cawl = text.text.strip()
     return cawl
 
 def get_cawl_from_sense(sense, cawl_type):
@@ -139,30 +406,204 @@ def get_cawl_from_sense(sense, cawl_type):
             break
     return cawl
 
-def get_semantic_domains_from_sense(sense):
-    semantic_domains_raw = []
-    traits = sense.findall("trait")
-    for trait in traits:
-        if trait.get('name') == "semantic-domain-ddp4":
-            sd = trait.get('value')
-            if sd is not None:
-                semantic_domains_raw.append(sd)
-    semantic_domains_raw = normalize_list(semantic_domains_raw)
-
-    # Consolidate repeated terms.
-    semantic_domains = []
-    for sd_raw in semantic_domains_raw:
-        sds = sd_raw.split(';')
-        sds = list(set([sd.strip() for sd in sds]))
-        semantic_domains.extend(sds)
-    semantic_domains = normalize_list(semantic_domains)
-
-    return semantic_domains
+@functools.lru_cache(maxsize=TERM_CACHE_SIZE)
+def split_text(text):
+    """Return the sorted, unique, stripped terms of a ';'-separated string.
+
+    Results are memoized and terms are interned, so a raw string that is
+    found on many senses (e.g. a semantic domain) is only split once per run.
+    """
+    return tuple(sorted({sys.intern(t.strip()) for t in text.split(';')}))
+
+@functools.lru_cache(maxsize=TERM_CACHE_SIZE)
+def normalize_text(text):
+    return ' ; '.join(split_text(text))
+
+def split_terms(values_raw):
+    # Consolidate repeated terms in glosses or semantic domains.
+    if len(values_raw) == 1:
+        return list(split_text(values_raw[0]))
+    terms = set()
+    for v_raw in values_raw:
+        terms.update(split_text(v_raw))
+    return sorted(terms)
+
+def join_terms(values_raw):
+    # Consolidate repeated terms into a single ';'-separated string.
+    if len(values_raw) == 1:
+        return normalize_text(values_raw[0])
+    return ' ; '.join(split_terms(values_raw))
+
+def update_cawl_dict(
+    target_cawls_dict, source_index, updates, stats=None, changes=None, progress=None, updated_senses=None
+):
+    """Update target senses grouped by CAWL. If given, progress is called as
+    progress('update', cawls_done, cawls_total). updated_senses is passed on
+    to update_senses."""
+    if stats is None:
+        stats = Counter()
+    # Loop through dict for CAWL #s in target file (10x faster than looping through XML).
+    total = len(target_cawls_dict)
+    for i, (cawl, target_senses) in enumerate(target_cawls_dict.items(), 1):
+        if progress is not None:
+            progress('update', i, total)
+        if cawl is None or cawl not in source_index:
+            continue
+        stats['cawl-matches'] += 1
+        update_senses(cawl, target_senses, source_index, updates, stats, changes, updated_senses)
+
+def update_entry(
+    entry, cawl_type, source_index, updates, stats=None, changes=None, fallback=None, matches=None, cawls_matched=None
+):
+    """Update an entry's senses grouped by CAWL, as update_cawl_dict does for
+    a whole file. If a cawls_matched set is given, the CAWLs matched are
+    added to it, and a CAWL that's already in it isn't counted as a match
+    again, so that matches are counted as they would be for the whole file."""
+    if stats is None:
+        stats = Counter()
+    senses_without_cawl = []
+    for cawl, senses in get_cawl_dict(entry, cawl_type).items():
+        if cawl is None:
+            senses_without_cawl.extend(senses)
+            continue
+        if cawl not in source_index:
+            continue
+        if cawls_matched is None or cawl not in cawls_matched:
+            stats['cawl-matches'] += 1
+        if cawls_matched is not None:
+            cawls_matched.add(cawl)
+        update_senses(cawl, senses, source_index, updates, stats, changes)
+    if fallback is not None:
+        update_fallback_senses(senses_without_cawl, fallback, source_index, updates, stats, changes, matches)
+
+def update_fallback_senses(senses, fallback, source_index, updates, stats=None, changes=None, matches=None):
+    """Update senses that have no CAWL from the source CAWL that a
+    fallback.FallbackIndex matches them to. If a matches list is given, a
+    record of each match and its confidence is appended to it."""
+    if stats is None:
+        stats = Counter()
+    for sense in senses:
+        match = fallback.match_sense(sense)
+        if match is None:
+            stats['fallback-unmatched'] += 1
+            continue
+        cawl, confidence, method, key = match
+        stats['fallback-matched'] += 1
+        if matches is not None:
+            matches.append({
+                'sense': get_sense_key(sense), 'cawl': cawl, 'confidence': round(confidence, 3),
+                'method': method, 'key': key,
+            })
+        if cawl in source_index:
+            stats['cawl-matches'] += 1
+            update_senses(cawl, [sense], source_index, updates, stats, changes)
+
+def get_sense_key(sense):
+    """Return how a sense is identified in changes: its id or, since LIFT
+    doesn't require one, its entry's guid (or id) and its position among the
+    entry's senses. None is returned if the entry has neither."""
+    sense_id = sense.get('id')
+    if sense_id is not None:
+        return sense_id
+    entry = next(sense.iterancestors('entry'), None)
+    if entry is None:
+        return None
+    entry_id = entry.get('guid') or entry.get('id')
+    if entry_id is None:
+        return None
+    position = next(i for i, s in enumerate(entry.iter('sense')) if s is sense)
+    return f"{entry_id}/{position}"
+
+def get_sense_values(sense, updates):
+    # Current text of each field that the given updates can change.
+    values = {('gloss', lang): [] for lang in updates.get('glosses', [])}
+    semantic_domain = updates.get('semantic-domain', False)
+    if semantic_domain:
+        values[('semantic-domain-ddp4', None)] = []
+    for child in sense.iterchildren('gloss', 'trait'):
+        if child.tag == 'gloss':
+            texts = values.get(('gloss', child.get('lang')))
+            if texts is not None:
+                texts.append(child.findtext('text'))
+        elif semantic_domain and child.get('name') == 'semantic-domain-ddp4':
+            values[('semantic-domain-ddp4', None)].append(child.get('value'))
+    return values
+
+def update_senses(cawl, target_senses, source_index, updates, stats=None, changes=None, updated_senses=None):
+    """Update the given target senses with data from the source index entry of the same CAWL.
+
+    If a changes list is given, a record of each changed field is appended to it.
+    If an updated_senses set is given, the senses updated are added to it, and
+    those already in it aren't counted as updated again.
+    """
+    if stats is None:
+        stats = Counter()
+    if updated_senses is None:
+        updated_senses = set()
+    n_updated = len(updated_senses)
+    if changes is not None:
+        old_values = [get_sense_values(sense, updates) for sense in target_senses]
+
+    # Update glosses.
+    for lang in updates.get('glosses', []):
+        allow_overwrite = updates.get('allow-overwrite', False)
+        if lang == 'sg':
+            print(f"Language is {lang}: automatically overwriting gloss for {cawl}")
+            allow_overwrite = True
+        #   NOTE: Is it worth comparing with existing value before replacing?
+        source_glosses = source_index.get_glosses(cawl, lang)
+        if len(source_glosses) > 0:
+            for sense in target_senses:
+                stats['glosses-deduped'] += dedupe_glosses(lang, sense)
+                action = update_gloss(lang, source_glosses, sense, allow_overwrite)
+                if action == 'created':
+                    stats['glosses-added'] += 1
+                    updated_senses.add(sense)
+                elif action == 'overwritten':
+                    stats['glosses-overwritten'] += 1
+                    updated_senses.add(sense)
+                elif action == 'skipped':
+                    stats['glosses-skipped'] += 1
+
+    # Update semantic domain.
+    if updates.get('semantic-domain', False):
+        allow_overwrite = True # always overwrite
+        source_semantic_domains = source_index.get_semantic_domains(cawl)
+        if len(source_semantic_domains) > 0:
+            for sense in target_senses:
+                # Replace semantic domain value in target.
+                #   NOTE: Is it worth comparing with existing value before replacing?
+                #   E.g. Many files have the same SD #, but use either FR or EN text with it.
+                stats['semantic-domains-deduped'] += dedupe_semantic_domains(sense)
+                action = update_semantic_domain(source_semantic_domains, sense, allow_overwrite)
+                if action in ('created', 'overwritten'):
+                    stats['semantic-domains-replaced'] += 1
+                    updated_senses.add(sense)
+                elif action == 'skipped':
+                    stats['semantic-domains-skipped'] += 1
+
+    stats['senses-updated'] += len(updated_senses) - n_updated
+    if changes is not None:
+        for sense, old_sense_values in zip(target_senses, old_values):
+            new_sense_values = get_sense_values(sense, updates)
+            for (field, lang), old in old_sense_values.items():
+                new = new_sense_values[(field, lang)]
+                if new != old:
+                    change = {'sense': get_sense_key(sense), 'field': field, 'old': old, 'new': new}
+                    if lang is not None:
+                        change['lang'] = lang
+                    changes.append(change)
+    return stats
 
 def update_gloss(lang, glosses, sense, allow_overwrite):
-    """Update an existing gloss field or add a new gloss field in the self.target_xml tree."""
+    """Update an existing gloss field or add a new gloss field in the self.target_xml tree.
+
+    Returns 'created', 'overwritten', 'skipped' (overwrite not allowed) or None
+    if the existing gloss already had the same text.
+    """
     gloss_exists = False
     updated = False
+    action = None
     glosses_text = ' ; '.join(glosses)
     for g in sense.findall('gloss'):
         if g.get('lang') == lang:
@@ -178,6 +619,9 @@ def update_gloss(lang, glosses, sense, allow_overwrite):
             g_lang.text = glosses_text
             if g_lang.text != old_g_lang_text:
                 updated = True
+                action = 'overwritten'
+        else:
+            action = 'skipped'
     else:
         # Create new gloss.
         gloss = etree.SubElement(sense, 'gloss')
@@ -185,13 +629,19 @@ def update_gloss(lang, glosses, sense, allow_overwrite):
         gloss_text = etree.SubElement(gloss, 'text')
         gloss_text.text = glosses_text
         updated = True
+        action = 'created'
     if updated:
         update_timestamps(sense)
+    return action
 
 def update_semantic_domain(semantic_domains, sense, allow_overwrite):
-    """Update an existing semantic domain field or add a new one in the given sense."""
+    """Update an existing semantic domain field or add a new one in the given sense.
+
+    Returns the same values as update_gloss.
+    """
     semantic_domain_trait = None
     updated = False
+    action = None
     sd_trait_text = ' ; '.join(semantic_domains)
     for t in sense.findall('trait'):
         if t.get('name') == 'semantic-domain-ddp4':
@@ -206,16 +656,24 @@ def update_semantic_domain(semantic_domains, sense, allow_overwrite):
             semantic_domain_trait.attrib['value'] = sd_trait_text
             if semantic_domain_trait.attrib['value'] != old_semantic_domain:
                 updated = True
+                action = 'overwritten'
+        else:
+            action = 'skipped'
     else:
         # Create new semantic domain trait.
         trait = etree.SubElement(sense, 'trait')
         trait.attrib['name'] = 'semantic-domain-ddp4'
         trait.attrib['value'] = sd_trait_text
         updated = True
+        action = 'created'
     if updated:
         update_timestamps(sense)
+    return action
 
-def dedupe_glosses(lang, sense):
+def dedupe_glosses(lang, sense, verbose=True):
+    """Merge all of the sense's glosses in the given language into one gloss
+    and return the number of gloss elements removed, printing each one if
+    verbose."""
     # Gather all existing glosses.
     glosses_texts = []
     all_glosses = sense.findall('gloss')
@@ -223,19 +681,13 @@ def dedupe_glosses(lang, sense):
         if gloss.get('lang') == lang:
             gloss_elem = gloss.find('text')
             glosses_texts.append(gloss_elem.text)
-    glosses_texts = normalize_list(glosses_texts)
 
     # Consolidate into a single updated string.
-    glosses = []
-    for glosses_text in glosses_texts:
-        gs = glosses_text.split(';')
-        gs = normalize_list(gs)
-        glosses.extend(gs)
-    glosses = normalize_list(glosses)
-    updated_glosses_text = ' ; '.join(glosses)
+    updated_glosses_text = join_terms(glosses_texts)
 
     # Update 1st instance & remove all others.
     updated = False
+    removed = 0
     for gloss in all_glosses:
         if gloss.get('lang') == lang:
             if not updated:
@@ -244,29 +696,29 @@ def dedupe_glosses(lang, sense):
                     g_elem.text = updated_glosses_text
                 updated = True
             else:
-                print(f"removed gloss {gloss}")
+                if verbose:
+                    print(f"removed gloss {gloss}")
                 sense.remove(gloss)
+                removed += 1
+    return removed
 
-def dedupe_semantic_domains(sense):
+def dedupe_semantic_domains(sense, verbose=True):
+    """Merge all of the sense's semantic domain traits into one trait and
+    return the number of trait elements removed, printing each one if
+    verbose."""
     # Gather all existing semantic domain info.
     sd_texts = []
     traits = sense.findall('trait')
     for trait in traits:
         if trait.get('name') == 'semantic-domain-ddp4':
             sd_texts.append(trait.get('value'))
-    sd_texts = normalize_list(sd_texts)
 
     # Consolidate into a single updated string.
-    semantic_domains = []
-    for sd_text in sd_texts:
-        sds = sd_text.split(';')
-        sds = normalize_list(sds)
-        semantic_domains.extend(sds)
-    semantic_domains = normalize_list(semantic_domains)
-    updated_sd_text = ' ; '.join(semantic_domains)
+    updated_sd_text = join_terms(sd_texts)
 
     # Update 1st instance & remove all others.
     updated = False
+    removed = 0
     for trait in traits:
         if trait.get('name') == 'semantic-domain-ddp4':
             if not updated:
@@ -274,8 +726,11 @@ def dedupe_semantic_domains(sense):
                     trait.attrib['value'] = updated_sd_text
                 updated = True
             else:
-                print(f"removed trait {trait}")
+                if verbose:
+                    print(f"removed trait {trait}")
                 sense.remove(trait)
+                removed += 1
+    return removed
 
 
 def normalize_list(mylist):
@@ -287,7 +742,24 @@ def normalize_list(mylist):
     mylist.sort()
     return mylist
 
-def parse_cli():
+COMMANDS = ['apply', 'batch', 'db', 'normalize', 'report', 'verify', 'watch']
+
+def get_confidence(value):
+    # Argument type for a fallback threshold.
+    try:
+        confidence = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid confidence: '{value}'")
+    if not 0 < confidence <= 1:
+        raise argparse.ArgumentTypeError(f"confidence must be greater than 0 and at most 1: '{value}'")
+    return confidence
+
+def parse_cli(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] in COMMANDS:
+        return parse_command_cli(argv[0], argv[1:])
+
     # Define arguments and options.
     parser = argparse.ArgumentParser(
         description="show or update FLEx database files in LIFT format",
@@ -307,6 +779,12 @@ def parse_cli():
         help=argparse.SUPPRESS,
         action='store_true',
     )
+    parser.add_argument(
+        '-x', '--extra-source',
+        metavar='FILE',
+        action='append',
+        help="another source file to get updates from; each field is taken from the 1st of source_db and the extra sources, in the order given, that has values for the CAWL",
+    )
     parser.add_argument(
         '-g', '--glosses',
         help="update glosses in target file(s) with given language(s) from source file; defaults to the language of the source file's 'lexical-unit', but this can be used to specify a language from the entry's glosses instead",
@@ -319,6 +797,34 @@ def parse_cli():
         '-I', '--target-id-type',
         help="the value used in the target's 'type' attribute to designate a CAWL entry [CAWL]",
     )
+    parser.add_argument(
+        '--fallback',
+        help="match target senses that have no CAWL to source CAWLs by their lexical-unit or gloss text, and save each match's confidence as a CSV file [False]",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--fallback-threshold',
+        type=get_confidence,
+        default=0.8,
+        metavar='CONFIDENCE',
+        help="the lowest confidence, greater than 0 and at most 1, at which a fallback match is used [0.8]",
+    )
+    parser.add_argument(
+        '--incremental',
+        metavar='MANIFEST',
+        help="only update CAWLs whose source glosses or semantic domains have changed since the run that saved MANIFEST; the manifest is saved after each successful run",
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help="number of target files to update in parallel worker processes [1]",
+    )
+    parser.add_argument(
+        '-n', '--dry-run',
+        help="save the changes that would be made to each target file as a changeset file instead of updating it [False]",
+        action='store_true',
+    )
     parser.add_argument(
         '-o', '--allow-overwrite',
         help="allow glosses in target file(s) to be overwritten [False]",
@@ -329,9 +835,262 @@ def parse_cli():
         help="update semantic domain info from source file to target file(s)",
         action='store_true',
     )
+    parser.add_argument(
+        '--patch',
+        help="copy unchanged entries byte for byte from the target file and only rewrite the entries that changed [False]",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--progress',
+        help="show a progress bar with the time left on stderr while each file is read, updated and written; not shown with -j [False]",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help="save the time and peak memory of each phase and the update counts for each target file as JSON to FILE",
+    )
+    parser.add_argument(
+        '--stream',
+        help="update target file(s) one entry at a time to keep memory use low for very large files [False]",
+        action='store_true',
+    )
+    parser.add_argument(
+        '-z', '--compress',
+        choices=['gz', 'xz', 'zst', 'none'],
+        help="compress updated file(s) with gzip, xz or zstd, or not at all; by default each is compressed like its target file",
+    )
     parser.add_argument(
         '-V', '--version',
         help="show app version",
         action='store_true',
     )
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    args.command = None
+    return args
+
+def parse_command_cli(command, argv):
+    parser = argparse.ArgumentParser(prog=f"update-flex {command}")
+    if command == 'apply':
+        parser.description = "apply a changeset saved with --dry-run to a target file"
+        parser.add_argument(
+            "changeset",
+            help="the changeset file to apply",
+        )
+        parser.add_argument(
+            "target_db",
+            help="the target file to be updated",
+        )
+    elif command == 'batch':
+        parser.description = "run the update jobs in a JSON or TOML manifest, reading each source and target file once"
+        parser.add_argument(
+            "manifest",
+            help="the manifest file; its paths are relative to its directory",
+        )
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help="number of source and target files to process in parallel worker processes [1]",
+        )
+        parser.add_argument(
+            '-z', '--compress',
+            choices=['gz', 'xz', 'zst', 'none'],
+            help="compress updated files with gzip, xz or zstd, or not at all; by default each is compressed like its target file",
+        )
+    elif command == 'db':
+        parser.description = "keep a target file in an SQLite database for repeated updates, and export it as LIFT"
+        actions = parser.add_subparsers(dest='action', required=True)
+        db_import = actions.add_parser('import', help="import a LIFT file into a new database")
+        db_import.add_argument(
+            "lift",
+            help="the LIFT file to import",
+        )
+        db_import.add_argument(
+            "db",
+            help="the database file; it's replaced if it exists",
+        )
+        db_import.add_argument(
+            '-I', '--target-id-type',
+            help="the value used in the file's 'type' attribute to designate a CAWL entry [CAWL]",
+        )
+        db_update = actions.add_parser('update', help="update the database from a source file")
+        db_update.add_argument(
+            "source_db",
+            help="the source file to get updates from",
+        )
+        db_update.add_argument(
+            "db",
+            help="the database file to be updated",
+        )
+        db_update.add_argument(
+            '-x', '--extra-source',
+            metavar='FILE',
+            action='append',
+            help="another source file to get updates from, as for the main command",
+        )
+        db_update.add_argument(
+            '-g', '--glosses',
+            help="update glosses with given language(s) from source file",
+        )
+        db_update.add_argument(
+            '-i', '--source-id-type',
+            help="the value used in the source's 'type' attribute to designate a CAWL entry [CAWL]",
+        )
+        db_update.add_argument(
+            '-o', '--allow-overwrite',
+            help="allow glosses to be overwritten [False]",
+            action='store_true',
+        )
+        db_update.add_argument(
+            '-s', '--semantic-domain',
+            help="update semantic domain info from source file",
+            action='store_true',
+        )
+        db_export = actions.add_parser('export', help="write the database as a LIFT file")
+        db_export.add_argument(
+            "db",
+            help="the database file to export",
+        )
+        db_export.add_argument(
+            "outfile",
+            help="the LIFT file to write; it's compressed if it ends with .gz, .xz or .zst",
+        )
+    elif command == 'normalize':
+        parser.description = "merge repeated glosses and semantic domains in every sense of LIFT files"
+        parser.add_argument(
+            "target_db",
+            nargs='+',
+            help="the file(s) to be normalized",
+        )
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help="number of worker processes that normalize chunks of each file's entries [1]",
+        )
+        parser.add_argument(
+            '-z', '--compress',
+            choices=['gz', 'xz', 'zst', 'none'],
+            help="compress normalized files with gzip, xz or zstd, or not at all; by default each is compressed like its input file",
+        )
+    elif command == 'report':
+        parser.description = "report how well the source covers the target files' CAWLs and fields, without changing them"
+        parser.add_argument(
+            "source_db",
+            help="the source file to get updates from",
+        )
+        parser.add_argument(
+            "target_db",
+            nargs='+',
+            help="the target file(s) to report on",
+        )
+        parser.add_argument(
+            '-x', '--extra-source',
+            metavar='FILE',
+            action='append',
+            help="another source file to get updates from, as for the main command",
+        )
+        parser.add_argument(
+            '-f', '--format',
+            choices=['json', 'csv'],
+            help="output format; defaults to CSV if OUTPUT ends with '.csv', otherwise JSON",
+        )
+        parser.add_argument(
+            '-g', '--glosses',
+            help="gloss language(s) to report on; defaults to all languages with glosses in the source",
+        )
+        parser.add_argument(
+            '-i', '--source-id-type',
+            help="the value used in the source's 'type' attribute to designate a CAWL entry [CAWL]",
+        )
+        parser.add_argument(
+            '-I', '--target-id-type',
+            help="the value used in the target's 'type' attribute to designate a CAWL entry [CAWL]",
+        )
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help="number of target files to read in parallel worker processes [1]",
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help="save the report to OUTPUT instead of printing it",
+        )
+    elif command == 'verify':
+        parser.description = "check that updated files differ from their originals only in glosses, semantic domains and dateModified attributes"
+        parser.add_argument(
+            "files",
+            nargs='+',
+            metavar='original updated',
+            help="pairs of original and updated files",
+        )
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help="number of files to read in parallel worker processes [1]",
+        )
+    elif command == 'watch':
+        parser.description = "keep the source index loaded and update each LIFT file that appears in a directory"
+        parser.add_argument(
+            "source_db",
+            help="the source file to get updates from; it's reloaded when it changes",
+        )
+        parser.add_argument(
+            "watch_dir",
+            help="the directory to watch for target files",
+        )
+        parser.add_argument(
+            '-x', '--extra-source',
+            metavar='FILE',
+            action='append',
+            help="another source file to get updates from, as for the main command",
+        )
+        parser.add_argument(
+            '-g', '--glosses',
+            help="update glosses in target files with given language(s) from source file",
+        )
+        parser.add_argument(
+            '-i', '--source-id-type',
+            help="the value used in the source's 'type' attribute to designate a CAWL entry [CAWL]",
+        )
+        parser.add_argument(
+            '-I', '--target-id-type',
+            help="the value used in the target's 'type' attribute to designate a CAWL entry [CAWL]",
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help="seconds between checks of the directory and source file(s) [2]",
+        )
+        parser.add_argument(
+            '-o', '--allow-overwrite',
+            help="allow glosses in target files to be overwritten [False]",
+            action='store_true',
+        )
+        parser.add_argument(
+            '-s', '--semantic-domain',
+            help="update semantic domain info from source file to target files",
+            action='store_true',
+        )
+        parser.add_argument(
+            '--patch',
+            help="only rewrite the entries that changed [False]",
+            action='store_true',
+        )
+        parser.add_argument(
+            '--stream',
+            help="update target files one entry at a time [False]",
+            action='store_true',
+        )
+    parser.add_argument(
+        '-d', '--debug',
+        help=argparse.SUPPRESS,
+        action='store_true',
+    )
+    args = parser.parse_args(argv)
+    args.command = command
+    return args
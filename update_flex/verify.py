@@ -0,0 +1,137 @@
+import difflib
+import hashlib
+import time
+
+from lxml import etree
+from pathlib import Path
+from sys import exit
+
+from . import util
+
+DIGEST_SIZE = 16
+# Differences listed for each pair of files.
+MAX_LISTED = 10
+
+
+def mask_entry(entry):
+    """Remove what an update is allowed to change from an entry: the senses'
+    glosses and semantic-domain-ddp4 traits, and dateModified attributes."""
+    entry.attrib.pop('dateModified', None)
+    for sense in entry.iter('sense'):
+        sense.attrib.pop('dateModified', None)
+        for child in sense.iterchildren('gloss', 'trait'):
+            if child.tag == 'gloss' or child.get('name') == 'semantic-domain-ddp4':
+                sense.remove(child)
+
+def get_digest(kind, elem):
+    if not isinstance(elem.tag, str):
+        # Comments and processing instructions can't be canonicalized.
+        data = etree.tostring(elem, with_tail=False)
+    elif kind == 'root':
+        data = etree.tostring(etree.Element(elem.tag, elem.attrib, elem.nsmap), method='c14n')
+    else:
+        if elem.tag == 'entry':
+            mask_entry(elem)
+        data = etree.tostring(elem, method='c14n')
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE, person=kind.encode()).digest()
+
+def hash_file(file_obj):
+    """Return the canonical digests of a LIFT file's comments and processing
+    instructions, root element and each of its children, in document order,
+    as one bytes object."""
+    return b''.join(get_digest(kind, elem) for kind, elem in util.iter_xml_file(file_obj))
+
+def get_labels(file_obj, positions):
+    # Describe the elements at the given positions, for reporting.
+    labels = dict()
+    positions = set(positions)
+    for i, (kind, elem) in enumerate(util.iter_xml_file(file_obj)):
+        if i in positions:
+            if kind == 'child' and not isinstance(elem.tag, str):
+                label = 'comment' if elem.tag is etree.Comment else 'pi'
+            else:
+                label = elem.tag if kind == 'child' else kind
+            for key in ('id', 'guid'):
+                if elem.get(key) is not None:
+                    label += f" {key}=\"{elem.get(key)}\""
+                    break
+            labels[i] = label
+            if len(labels) == len(positions):
+                break
+    return labels
+
+def split_digests(digests):
+    return [digests[i:i + DIGEST_SIZE] for i in range(0, len(digests), DIGEST_SIZE)]
+
+def compare_digests(old_digests, new_digests):
+    """Return (position, difference) for each element that differs, where
+    difference is 'changed', 'missing' (from the updated file) or 'extra'.
+    Positions are in the original file, except for extra elements."""
+    if old_digests == new_digests:
+        return []
+    old_items = split_digests(old_digests)
+    new_items = split_digests(new_digests)
+    # Only the part between the common start and end needs to be aligned.
+    start = 0
+    while start < min(len(old_items), len(new_items)) and old_items[start] == new_items[start]:
+        start += 1
+    end = 0
+    while end < min(len(old_items), len(new_items)) - start and old_items[-end - 1] == new_items[-end - 1]:
+        end += 1
+    matcher = difflib.SequenceMatcher(
+        None, old_items[start:len(old_items) - end], new_items[start:len(new_items) - end], autojunk=False
+    )
+    differences = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        # Replaced elements are paired up as changed ones.
+        n_changed = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+        differences.extend((start + i, 'changed') for i in range(i1, i1 + n_changed))
+        differences.extend((start + i, 'missing') for i in range(i1 + n_changed, i2))
+        differences.extend((start + j, 'extra') for j in range(j1 + n_changed, j2))
+    return differences
+
+def report_pair(original, updated, differences, n_elements):
+    if not differences:
+        print(f"{updated.name}: OK, {n_elements} elements match \"{original.name}\"")
+        return
+    print(f"{updated.name}: {len(differences)} unexpected differences from \"{original.name}\"")
+    listed = differences[:MAX_LISTED]
+    old_labels = get_labels(original, [i for i, d in listed if d != 'extra'])
+    new_labels = get_labels(updated, [i for i, d in listed if d == 'extra'])
+    for i, difference in listed:
+        label = new_labels.get(i) if difference == 'extra' else old_labels.get(i)
+        print(f"  element {i} ({label}): {difference}")
+    if len(differences) > MAX_LISTED:
+        print(f"  ... and {len(differences) - MAX_LISTED} more")
+
+def main(args):
+    if len(args.files) % 2:
+        print("ERROR: Files must be given in pairs: original updated [original updated ...]")
+        exit(1)
+    files = [Path(f).resolve() for f in args.files]
+    pairs = list(zip(files[0::2], files[1::2]))
+    start = time.perf_counter()
+    try:
+        if args.jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Both files of a pair are read at the same time in their own process.
+            with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                digests = list(executor.map(hash_file, files))
+        else:
+            digests = [hash_file(f) for f in files]
+    except (OSError, etree.XMLSyntaxError) as e:
+        print(f"Error: {e}")
+        exit(1)
+
+    failed = False
+    for (original, updated), old_digests, new_digests in zip(pairs, digests[0::2], digests[1::2]):
+        differences = compare_digests(old_digests, new_digests)
+        report_pair(original, updated, differences, len(old_digests) // DIGEST_SIZE)
+        if differences:
+            failed = True
+    print(f"Verified {len(pairs)} files in {time.perf_counter() - start:.2f}s")
+    if failed:
+        exit(1)
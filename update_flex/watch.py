@@ -0,0 +1,100 @@
+import time
+
+from pathlib import Path
+from sys import exit
+
+from . import engine
+from . import util
+
+
+def get_mtimes(source_files):
+    # A missing file (e.g. one that's being re-exported) has no mtime.
+    mtimes = []
+    for f in source_files:
+        try:
+            mtimes.append(f.stat().st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(None)
+    return mtimes
+
+def get_lift_files(watch_dir):
+    # Plain or compressed LIFT files.
+    return [f for f in watch_dir.glob('*.lift*') if f.name.endswith('.lift' + util.get_compression_suffix(f))]
+
+def get_ready_targets(watch_dir, tag, seen):
+    """Return LIFT files that are new or changed since they were last seen and
+    whose size hasn't changed since the previous check."""
+    ready = []
+    for target_file in sorted(get_lift_files(watch_dir)):
+        if tag in target_file.name:
+            # Skip files written by this app.
+            continue
+        try:
+            stat = target_file.stat()
+        except FileNotFoundError:
+            continue
+        state = (stat.st_mtime_ns, stat.st_size)
+        last = seen.get(target_file)
+        if last == state + (True,):
+            continue
+        if last == state + (False,):
+            # Unchanged since the previous check: the file is completely written.
+            ready.append((target_file, state))
+        else:
+            seen[target_file] = state + (False,)
+    return ready
+
+def is_up_to_date(target_file, tag):
+    # The target was already updated by a previous run.
+    outfile = util.get_outfile_object(target_file, tag, False)
+    return outfile.is_file() and outfile.stat().st_mtime_ns >= target_file.stat().st_mtime_ns
+
+def main(args):
+    source_files = [Path(f).resolve() for f in [args.source_db] + (args.extra_source or [])]
+    watch_dir = Path(args.watch_dir).resolve()
+    options = engine.Options.from_args(args)
+
+    updater = engine.Updater(source_files, options)
+    try:
+        updater.load_source()
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        exit(1)
+    source_mtimes = get_mtimes(source_files)
+    # Reloads keep the gloss languages found now, so that outputs keep their names.
+    options.glosses = updater.updates.get('glosses')
+    tag = util.get_outfile_tag(updater.updates)
+    print(f"Source index: {updater.source_index}")
+    print(f"Watching \"{watch_dir}\" for LIFT files; press Ctrl+C to stop")
+
+    # Files that were already there are skipped if they've been updated before.
+    existing = set(get_lift_files(watch_dir))
+    seen = dict()
+    try:
+        while True:
+            # Reload the source only when one of its files has changed, and
+            #   keep the loaded one while any of them is missing.
+            mtimes = get_mtimes(source_files)
+            if mtimes != source_mtimes and None not in mtimes:
+                try:
+                    reloaded = engine.Updater(source_files, options)
+                    reloaded.load_source()
+                    updater = reloaded
+                    source_mtimes = mtimes
+                    print(f"Source reloaded: {updater.source_index}")
+                except Exception as e:
+                    # The source may still be being written; try again next time.
+                    print(f"Error: {e}")
+
+            for target_file, state in get_ready_targets(watch_dir, tag, seen):
+                seen[target_file] = state + (True,)
+                if target_file in existing and is_up_to_date(target_file, tag):
+                    continue
+                result = updater.update(target_file)
+                if result.ok:
+                    print(engine.get_summary(result.get_name(), result.stats))
+                else:
+                    print(f"{result.get_name()}: update failed")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")